@@ -1,8 +1,11 @@
 import os
 import sys
 import math
+import functools
 import numpy as np
 from reedsolo import RSCodec, ReedSolomonError
+from concurrent.futures import ProcessPoolExecutor
+import metrics
 
 import os
 import sys
@@ -49,6 +52,58 @@ def read_file(file_path: str):
         sys.exit()
 
 
+DICOM_HEADER_LEN = 1664  # Bytes of the DICOM header, kept aligned when slices differ in length
+DEFAULT_KEYFRAMES = (0, 21)  # Slices stored without XOR in the DICOM example
+
+
+def map_file(file_path: str):
+    """
+    Memory-map a file as a read-only uint8 array.
+
+    Args:
+    - file_path (str): File name.
+
+    Returns:
+    - numpy.ndarray: uint8 view of the file (an empty array for an empty file).
+    """
+    if os.path.getsize(file_path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(file_path, dtype=np.uint8, mode='r')
+
+
+def dicom_xor_array(ref, target):
+    """
+    XOR a target slice with a reference slice, as uint8 arrays.
+
+    The header (DICOM_HEADER_LEN bytes) of both slices is XORed in place; after it, a shorter reference is
+    padded with zeros and a longer one is trimmed at the start of its body, without building copies.
+
+    Args:
+    - ref (numpy.ndarray or bytes): Reference byte sequence.
+    - target (numpy.ndarray or bytes): Target byte sequence.
+
+    Returns:
+    - numpy.ndarray: XOR result (uint8).
+    """
+    ref = np.frombuffer(ref, dtype=np.uint8) if not isinstance(ref, np.ndarray) else ref
+    target = np.frombuffer(target, dtype=np.uint8) if not isinstance(target, np.ndarray) else target
+    ref_head = ref[:DICOM_HEADER_LEN]
+    if len(ref) < len(target):
+        body_start = len(ref_head) + len(target) - len(ref)
+        ref_body = ref[DICOM_HEADER_LEN:]
+    else:
+        body_start = len(ref_head)
+        ref_body = ref[DICOM_HEADER_LEN + len(ref) - len(target):]
+    xor_len = min(body_start + len(ref_body), len(target))
+
+    xor_array = np.array(target[:xor_len], dtype=np.uint8)
+    head_len = min(len(ref_head), xor_len)
+    np.bitwise_xor(xor_array[:head_len], ref_head[:head_len], out=xor_array[:head_len])
+    body_len = max(xor_len - body_start, 0)
+    np.bitwise_xor(xor_array[body_start:xor_len], ref_body[:body_len], out=xor_array[body_start:xor_len])
+    return xor_array
+
+
 def dicom_xor_reference(byte_seq0, byte_seq1):  # Input: two byte sequences
     """
     XOR two byte sequences.
@@ -60,15 +115,7 @@ def dicom_xor_reference(byte_seq0, byte_seq1):  # Input: two byte sequences
     Returns:
     - bytes: XOR result.
     """
-    if len(byte_seq0) < len(byte_seq1):
-        add_length = bytearray([0] * (len(byte_seq1) - len(byte_seq0)))
-        byte_seq0 = byte_seq0[0:1664] + add_length + byte_seq0[1664:]
-    else:
-        minus_len = len(byte_seq0) - len(byte_seq1)
-        byte_seq0 = byte_seq0[0:1664] + byte_seq0[1664 + minus_len:]
-
-    xor_byte = bytes([a ^ b for a, b in zip(byte_seq0, byte_seq1)])
-    return xor_byte
+    return dicom_xor_array(byte_seq0, byte_seq1).tobytes()
 
 
 def xor_reference(byte_seq0, byte_seq1):  # Input: two byte sequences
@@ -82,60 +129,206 @@ def xor_reference(byte_seq0, byte_seq1):  # Input: two byte sequences
     Returns:
     - bytes: XOR result.
     """
-    if len(byte_seq0) < len(byte_seq1):
-        add_length = bytearray([0] * (len(byte_seq1) - len(byte_seq0)))
-        byte_seq0 = byte_seq0 + add_length
+    ref = np.frombuffer(byte_seq0, dtype=np.uint8)
+    xor_array = np.array(np.frombuffer(byte_seq1, dtype=np.uint8))
+    if len(ref) < len(xor_array):
+        np.bitwise_xor(xor_array[:len(ref)], ref, out=xor_array[:len(ref)])
     else:
-        minus_len = len(byte_seq0) - len(byte_seq1)
-        byte_seq0 = byte_seq0[minus_len:]
+        np.bitwise_xor(xor_array, ref[len(ref) - len(xor_array):], out=xor_array)
+    return xor_array.tobytes()
+
+
+def select_keyframes(file_path_list, keyframes=DEFAULT_KEYFRAMES, similarity=0.5):
+    """
+    Choose the keyframe slices, which are stored as they are and start a new XOR chain.
+
+    Args:
+    - file_path_list (list): List of file names, in slice order.
+    - keyframes: List of keyframe indices, an int K for one keyframe every K slices, or 'auto' to start a new
+      chain when more than a fraction similarity of the bytes of a slice differ from the previous slice
+      (slices of different lengths are aligned at the header, see dicom_xor_array).
+    - similarity (float): Fraction of differing bytes above which 'auto' starts a new chain.
+
+    Returns:
+    - list: Sorted keyframe indices (slice 0 is always a keyframe).
+    """
+    slice_num = len(file_path_list)
+    if keyframes == 'auto':
+        keyframe_list = []
+        file0 = None
+        for i in range(slice_num):
+            file1 = map_file(file_path_list[i])
+            if i == 0 or np.count_nonzero(dicom_xor_array(file0, file1)) > similarity * len(file1):
+                keyframe_list.append(i)
+            file0 = file1
+        return keyframe_list
+    if isinstance(keyframes, (int, np.integer)):
+        return list(range(0, slice_num, int(keyframes)))
+    return sorted(set([0] + [int(i) for i in keyframes if i < slice_num])) if slice_num else []
+
+
+def nonzero_rows(byte_array, row_len=34):
+    """
+    Count the rows of row_len bytes (one Palette segment each, a_len bytes) that are not all zero.
+
+    Args:
+    - byte_array (numpy.ndarray): uint8 array.
+    - row_len (int): Row length in bytes.
+
+    Returns:
+    - int: Number of non-zero rows (the last partial row is zero padded).
+    """
+    full_len = len(byte_array) - len(byte_array) % row_len
+    count = int(np.count_nonzero(byte_array[:full_len].reshape(-1, row_len).any(axis=1)))
+    return count + int(byte_array[full_len:].any())
+
+
+def select_references(file_path_list, keyframes=DEFAULT_KEYFRAMES, row_len=34, keyframe_window=4):
+    """
+    Choose the reference of every slice among the previous slice, the last keyframe_window keyframes and none
+    (stored as it is), minimizing the number of non-zero rows to encode (see nonzero_rows). Slices without a
+    reference become keyframes for the next slices.
+
+    Args:
+    - file_path_list (list): List of file names, in slice order.
+    - keyframes: Slices that are always stored as they are (see select_keyframes).
+    - row_len (int): Row length in bytes.
+    - keyframe_window (int): Number of recent keyframes tried as references.
+
+    Returns:
+    - list: Reference index of every slice, -1 for none.
+    """
+    forced = set(select_keyframes(file_path_list, keyframes))
+    reference_list = []
+    file0 = None
+    keyframe_list = []
+    for i in range(len(file_path_list)):
+        file1 = map_file(file_path_list[i])
+        reference = -1
+        if i not in forced:
+            cost = nonzero_rows(file1, row_len)
+            candidates = [(i - 1, file0)] + [keyframe for keyframe in keyframe_list if keyframe[0] != i - 1]
+            for candidate, ref in candidates:
+                candidate_cost = nonzero_rows(dicom_xor_array(ref, file1), row_len)
+                if candidate_cost < cost:
+                    reference, cost = candidate, candidate_cost
+        if reference == -1:
+            keyframe_list = (keyframe_list + [(i, file1)])[-keyframe_window:]
+        reference_list.append(reference)
+        file0 = file1
+    return reference_list
+
+
+def chain_references(slice_num, keyframe_list):
+    """
+    References of plain XOR chains: every slice refers to the previous one, keyframes to none.
+
+    Args:
+    - slice_num (int): Number of slices.
+    - keyframe_list (list): Keyframe indices.
 
-    xor_byte = bytes([a ^ b for a, b in zip(byte_seq0, byte_seq1)])
-    return xor_byte
+    Returns:
+    - list: Reference index of every slice, -1 for none.
+    """
+    keyframe_set = set(keyframe_list)
+    return [-1 if i in keyframe_set else i - 1 for i in range(slice_num)]
 
 
-def differential_enc(file_path_list, xor_file_name):
+def differential_enc(file_path_list, xor_file_name, keyframes=DEFAULT_KEYFRAMES, adaptive=False, row_len=34):
     """
     Perform incremental encoding on files.
 
+    The slices are memory-mapped and each one is XORed with its reference slice, kept in memory until its
+    last use: the previous slice, or with adaptive the best of the previous slice, the last keyframe and
+    none (see select_references). Keyframes are stored as they are.
+
     Args:
     - file_path_list (list): List of file names.
     - xor_file_name (str): Output folder for encoded files.
+    - keyframes: Keyframe indices, one keyframe every K slices or 'auto' (see select_keyframes).
+    - adaptive (bool): Choose the reference of every slice to minimize the number of non-zero rows.
+    - row_len (int): Row length in bytes for adaptive (a_len).
+
+    Returns:
+    - list: Reference index of every slice (-1 for none), needed by differential_dec.
     """
     file_path_list.sort()
+    if adaptive:
+        reference_list = select_references(file_path_list, keyframes, row_len)
+    else:
+        reference_list = chain_references(len(file_path_list), select_keyframes(file_path_list, keyframes))
+    last_use = {reference: i for i, reference in enumerate(reference_list) if reference >= 0}
 
+    slice_dic = {}
     for i in range(0, len(file_path_list)):
         xor_file_path = os.path.join(xor_file_name+"/preprocess_DICOM{:03}".format(i) + '.txt')
+        file1 = map_file(file_path_list[i])
         with open(xor_file_path, 'wb') as f:
-            if i == 0 or i == 21:
-                f.write(read_file(file_path_list[i]))
+            if reference_list[i] < 0:
+                f.write(file1)
             else:
-                file0 = read_file(file_path_list[i - 1])
-                file1 = read_file(file_path_list[i])
-                differential_file = dicom_xor_reference(file0, file1)
-                f.write(differential_file)
+                f.write(dicom_xor_array(slice_dic[reference_list[i]], file1))
+        _keep_slice(slice_dic, last_use, i, file1)
+    return reference_list
 
 
-def differential_dec(xor_path_list, re_xor_file_name):
+def differential_dec(xor_path_list, re_xor_file_name, keyframes=DEFAULT_KEYFRAMES, workers=1, references=None):
     """
     Restore incrementally encoded files.
 
+    Every slice without a reference starts an independent group of slices (an XOR chain for plain keyframes);
+    the groups are restored in a process pool, each keeping the restored slices it still needs in memory
+    instead of reading them back from the output folder.
+
     Args:
     - xor_path_list (list): List of file names.
     - re_xor_file_name (str): Output folder for restored files.
+    - keyframes: Keyframe indices returned by differential_enc, or one keyframe every K slices.
+    - workers (int): Number of processes restoring groups (None: number of CPUs).
+    - references (list): Reference index of every slice returned by differential_enc (replaces keyframes).
     """
     xor_path_list.sort()
+    if references is None:
+        if keyframes == 'auto':
+            print("Automatic keyframes must be given as the list returned by differential_enc")
+            raise RuntimeError
+        references = chain_references(len(xor_path_list), select_keyframes(xor_path_list, keyframes))
+
+    root_list = []
+    for i, reference in enumerate(references):
+        root_list.append(i if reference < 0 else root_list[reference])
+    group_list = [[i for i in range(len(references)) if root_list[i] == root] for root in sorted(set(root_list))]
+    group_args = [([xor_path_list[i] for i in group], group, [references[i] for i in group], re_xor_file_name)
+                  for group in group_list]
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1 or len(group_args) < 2:
+        for args in group_args:
+            _differential_dec_group(*args)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_differential_dec_group, *zip(*group_args)))
 
-    for i in range(0, len(xor_path_list)):
+
+def _differential_dec_group(path_list, index_list, reference_list, re_xor_file_name):
+    # Restore one group of slices in index order, each XORed with its restored reference
+    last_use = {reference: i for i, reference in zip(index_list, reference_list) if reference >= 0}
+    slice_dic = {}
+    for xor_path, i, reference in zip(path_list, index_list, reference_list):
         re_xor_file_path = os.path.join(re_xor_file_name+"/re_DICOM{:03}".format(i) + '.dcm')
+        file1 = map_file(xor_path)
+        pre_file = file1 if reference < 0 else dicom_xor_array(slice_dic[reference], file1)
         with open(re_xor_file_path, 'wb') as f:
-            if i == 0 or i == 21:
-                pre_file = read_file(xor_path_list[i])
-                f.write(pre_file)
-            else:
-                file1 = read_file(xor_path_list[i])
-                file0 = read_file(re_xor_file_name+"/re_DICOM{:03}".format(i - 1) + '.dcm')
-                pre_file = dicom_xor_reference(file0, file1)
-                f.write(pre_file)
+            f.write(pre_file)
+        _keep_slice(slice_dic, last_use, i, pre_file)
+
+
+def _keep_slice(slice_dic, last_use, i, slice_array):
+    # Keep slice i while a later slice refers to it, and drop the slices no longer referenced
+    if last_use.get(i, -1) > i:
+        slice_dic[i] = slice_array
+    for j in [j for j in slice_dic if last_use[j] <= i]:
+        del slice_dic[j]
 
 
 def rs_encode(file_txt0, a_len):
@@ -149,12 +342,32 @@ def rs_encode(file_txt0, a_len):
     Returns:
     - Codeword for DNA Ladder code and original file text length.
     """
+    enc_word_array, file_txt_len = rs_encode_array(file_txt0, a_len)
+    enc_word = (np.unpackbits(enc_word_array) + ord('0')).tobytes().decode()
+
+    return enc_word, file_txt_len
+
+
+def rs_encode_array(file_txt0, a_len, workers=1):
+    """
+    RS encode the given file text, keeping the codeword as bytes.
+
+    Parameters:
+    - file_txt0: Original file text to be encoded.
+    - a_len: Radix.
+    - workers: Number of processes encoding the columns (None: number of CPUs).
+
+    Returns:
+    - Codeword for DNA Ladder code as a uint8 array and original file text length.
+    """
     e = 8
     n = 2 ** e - 1
     k = 32
     rsc = RSCodec(k, nsize=n)
 
     file_txt_len = len(file_txt0)
+    if workers is None:
+        workers = os.cpu_count()
 
     file_txt_enc_len = int(math.ceil(file_txt_len / a_len) * a_len)
     if len(file_txt0) % a_len != 0:
@@ -167,13 +380,22 @@ def rs_encode(file_txt0, a_len):
     enc_word_array = np.zeros(
         (a_len, int(np.ceil((file_txt_enc_len // a_len) / (n - k)) * k + file_txt_enc_len // a_len)), dtype=int)
 
-    for i in range(a_len):
-        enc_word_array[i, :] = rsc.encode(file_txt_arr[i])
+    if workers == 1:
+        for i in range(a_len):
+            enc_word_array[i, :] = rsc.encode(file_txt_arr[i])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for i, enc_column in enumerate(executor.map(_rs_encode_column, file_txt_arr, [k] * a_len, [n] * a_len)):
+                enc_word_array[i, :] = enc_column
 
-    enc_word_array = enc_word_array.transpose().flatten()
-    enc_word = ''.join(bin(val)[2:].rjust(e, '0') for val in enc_word_array)
+    enc_word_array = enc_word_array.transpose().flatten().astype(np.uint8)
 
-    return enc_word, file_txt_len
+    return enc_word_array, file_txt_len
+
+
+def _rs_encode_column(column, k, n):
+    # RS encode one column of a file
+    return RSCodec(k, nsize=n).encode(column)
 
 
 def rs_decode(dec_dic, file_len_dic, a_len):
@@ -188,45 +410,180 @@ def rs_decode(dec_dic, file_len_dic, a_len):
     Returns:
     - Dictionary containing the RS-decoded binary sequence for each file.
     """
+    byte_dic = {}
+    for id_num in dec_dic.keys():
+        rs_binary_str = dec_dic[id_num]
+        byte_dic[id_num] = np.packbits(np.frombuffer(rs_binary_str.encode(), dtype=np.uint8) - ord('0'))
+
+    return rs_decode_array(byte_dic, file_len_dic, a_len)
+
+
+def rs_decode_array(dec_dic, file_len_dic, a_len, workers=1):
+    """
+    Decode the given dictionary of RS-encoded byte arrays.
+
+    Parameters:
+    - dec_dic: Dictionary containing the RS encoded sequence of each file as a uint8 array.
+    - file_len_dic: Dictionary containing the original length of each file.
+    - a_len: Radix.
+    - workers: Number of processes decoding the RS blocks (None: number of CPUs).
+
+    Returns:
+    - Dictionary containing the RS-decoded binary sequence for each file.
+    """
+    return rs_decode_report(dec_dic, file_len_dic, a_len, workers)[0]
+
+
+def rs_decode_report(dec_dic, file_len_dic, a_len, workers=1):
+    """
+    Decode the given dictionary of RS-encoded byte arrays and report the corrections of every block.
+
+    The RS blocks of all columns of all files are decoded together, split over a pool of workers processes.
+
+    Parameters:
+    - dec_dic: Dictionary containing the RS encoded sequence of each file as a uint8 array.
+    - file_len_dic: Dictionary containing the original length of each file.
+    - a_len: Radix.
+    - workers: Number of processes decoding the RS blocks (None: number of CPUs).
+
+    Returns:
+    - Dictionary containing the RS-decoded binary sequence for each file.
+    - Dictionary containing, for each file, an array (a_len x blocks per column) with the number of corrected
+      bytes of every RS block, -1 where the block could not be decoded.
+    """
 
     e = 8
     n = 2 ** e - 1
     k = 32
-    rsc = RSCodec(k, nsize=n)
-    rs_error = 0
-
-    rs_dec_dic = {}
 
+    # Cut every column of every file into RS blocks (the last one may be shorter)
+    block_list = []
     for id_num in dec_dic.keys():
-        rs_binary_str = dec_dic[id_num]
-        err_array = bytearray(int(rs_binary_str, 2).to_bytes(len(rs_binary_str) // 8, byteorder='big'))
-        dec_txt_arr = np.array(err_array).reshape(len(err_array) // a_len, a_len).T
-        dec_word_array = np.zeros((a_len, len(err_array) // a_len - int(np.ceil(len(err_array) / a_len / n) * k)),
-                                  np.uint8)
+        err_array = np.asarray(dec_dic[id_num], dtype=np.uint8)
+        dec_txt_arr = err_array.reshape(len(err_array) // a_len, a_len).T
+        for t in range(a_len):
+            for i in range(0, dec_txt_arr.shape[1], n):
+                block_list.append(dec_txt_arr[t, i:i + n])
+
+    # Blocks with all-zero syndromes are codewords: keep their data bytes, decode only the others
+    clean = rs_clean_blocks(block_list, k)
+    dec_block_list = [block[:-k] for block in block_list]
+    correction_list = [0] * len(block_list)
+    dirty_index = np.flatnonzero(~clean)
+    if workers is None:
+        workers = os.cpu_count()
+    metrics.inc('rs_clean_blocks', int(clean.sum()))
+    with metrics.timer('rs_decode_blocks'):
+        dirty_dec_list, dirty_correction_list = _rs_decode_blocks([block_list[i] for i in dirty_index], k, n, workers)
+    for i, dec_block, corrections in zip(dirty_index, dirty_dec_list, dirty_correction_list):
+        dec_block_list[i] = dec_block
+        correction_list[i] = corrections
 
+    rs_dec_dic = {}
+    correction_dic = {}
+    block_index = 0
+    for id_num in dec_dic.keys():
+        column_len = len(dec_dic[id_num]) // a_len
+        block_num = math.ceil(column_len / n)
+        dec_word_array = np.zeros((a_len, column_len - block_num * k), np.uint8)
         for t in range(a_len):
-            for i in range(len(dec_txt_arr[t]) // n):
-                try:
-                    dec_word = rsc.decode(dec_txt_arr[t][n * i: n * (i + 1)])[0]
-                    dec_word_array[t][(n - k) * i:(n - k) * (i + 1)] = np.array(dec_word)
-                except:
-                    dec_word_array[t][(n - k) * i:(n - k) * (i + 1)] = dec_txt_arr[t][n * i: n * i + n - k]
-                    rs_error += 1
-
-            if len(dec_txt_arr[t]) % n != 0:
-                try:
-                    dec_word_array[t][(n - k) * (len(dec_txt_arr[t]) // n):] = np.array(
-                        rsc.decode(dec_txt_arr[t][n * (len(dec_txt_arr[t]) // n):])[0])
-                except:
-                    dec_word_array[t][(n - k) * (len(dec_txt_arr[t]) // n):] = dec_txt_arr[t][
-                                                                               n * (len(dec_txt_arr[t]) // n): -k]
+            dec_word_array[t] = np.concatenate(dec_block_list[block_index:block_index + block_num])
+            block_index += block_num
+        correction_dic[id_num] = np.array(correction_list[block_index - a_len * block_num:block_index],
+                                          dtype=np.int64).reshape(a_len, block_num)
 
         dec_word0 = np.copy((dec_word_array.transpose()).flatten())
         dec_word0 = dec_word0[:file_len_dic[id_num]]
         rs_dec_dic[id_num] = dec_word0
 
+    rs_error = sum(int(np.sum(corrections < 0)) for corrections in correction_dic.values())
+    if metrics.enabled():
+        for id_num, corrections in correction_dic.items():
+            metrics.observe('rs_block_corrections', corrections[corrections >= 0], metrics.RS_CORRECTION_BUCKETS,
+                            {'file': id_num})
+            metrics.inc('rs_block_failures', int(np.sum(corrections < 0)), {'file': id_num})
     #print('Number of RS decoding errors:', rs_error)
-    return rs_dec_dic
+    return rs_dec_dic, correction_dic
+
+
+def rs_clean_blocks(block_list, k, prim=0x11d):
+    """
+    Check which RS blocks are error-free by computing all their syndromes at once.
+
+    Uses the conventions of RSCodec(k, nsize=n): generator 2, first consecutive root 0 and the given
+    primitive polynomial. Blocks of the same length are evaluated together with GF(256) log/antilog tables.
+
+    Parameters:
+    - block_list: List of RS blocks (uint8 arrays).
+    - k: Number of RS check bytes.
+    - prim: Primitive polynomial of GF(256).
+
+    Returns:
+    - Boolean array, True for the blocks whose syndromes are all zero.
+    """
+    gf_exp, gf_log = _gf_tables(prim)
+    clean = np.zeros(len(block_list), dtype=bool)
+    block_lens = np.array([len(block) for block in block_list], dtype=np.int64)
+    for block_len in np.unique(block_lens):
+        index = np.flatnonzero(block_lens == block_len)
+        blocks = np.array([block_list[i] for i in index], dtype=np.int64)
+        # Horner evaluation of every block at alpha^0 ... alpha^(k-1)
+        synd = np.zeros((len(index), k), dtype=np.int64)
+        powers = np.arange(k, dtype=np.int64)
+        for i in range(block_len):
+            nonzero = synd != 0
+            synd[nonzero] = gf_exp[(gf_log[synd[nonzero]] + np.broadcast_to(powers, synd.shape)[nonzero]) % 255]
+            synd ^= blocks[:, i:i + 1]
+        clean[index] = ~synd.any(axis=1)
+    return clean
+
+
+@functools.lru_cache(maxsize=4)
+def _gf_tables(prim):
+    # GF(256) antilog and log tables for the primitive polynomial prim
+    gf_exp = np.zeros(255, dtype=np.int64)
+    gf_log = np.zeros(256, dtype=np.int64)
+    x = 1
+    for i in range(255):
+        gf_exp[i] = x
+        gf_log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= prim
+    return gf_exp, gf_log
+
+
+def _rs_decode_blocks(block_list, k, n, workers):
+    # Decode RS blocks, in chunks spread over a process pool when workers > 1 (None: number of CPUs)
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1 or len(block_list) < 2:
+        return _rs_decode_chunk(block_list, k, n)
+    chunk_len = math.ceil(len(block_list) / (4 * workers))
+    chunks = [block_list[i:i + chunk_len] for i in range(0, len(block_list), chunk_len)]
+    dec_block_list, correction_list = [], []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for dec_blocks, corrections in executor.map(_rs_decode_chunk, chunks, [k] * len(chunks),
+                                                    [n] * len(chunks)):
+            dec_block_list.extend(dec_blocks)
+            correction_list.extend(corrections)
+    return dec_block_list, correction_list
+
+
+def _rs_decode_chunk(block_list, k, n):
+    # Decode a list of RS blocks, keeping the systematic part of the blocks that cannot be decoded
+    rsc = RSCodec(k, nsize=n)
+    dec_block_list = []
+    correction_list = []
+    for block in block_list:
+        try:
+            dec_word, _, errata_pos = rsc.decode(block)
+            dec_block_list.append(np.frombuffer(bytes(dec_word), dtype=np.uint8))
+            correction_list.append(len(errata_pos))
+        except ReedSolomonError:
+            dec_block_list.append(np.array(block[:-k], dtype=np.uint8))
+            correction_list.append(-1)
+    return dec_block_list, correction_list
 
 
 if __name__ == '__main__':
@@ -1,9 +1,19 @@
 import numpy as np
 import math
+import base64
 import random
-from vt_enc import vt_encode, vt_decode
+from vt_enc import vt_encode_batch, vt_decode_batch, vt_systematic_index
+from vt import pad_rows
 from collections import Counter,defaultdict
 import copy
+import functools
+import metrics
+
+# Key word for DICOM
+DICOM_KEY = '02131213030120302130320121210321303132020231031021312031212021310123203010213120203012230303120121311032110320123020203131023031230121320301202132'
+
+# Soft vote weights are summed as integers in units of 1 / WEIGHT_SCALE (see SoftVoteAccumulator)
+WEIGHT_SCALE = 256
 
 
 def str_to_int(or_str):
@@ -44,6 +54,45 @@ def xor_decrypt(input_string, key):
     return decrypted
 
 
+def bytes_to_quan(byte_array):
+    # Convert a uint8 byte array to a uint8 array of quaternary symbols (4 per byte, MSB first)
+    byte_array = np.asarray(byte_array, dtype=np.uint8)
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+    return ((byte_array[:, None] >> shifts) & 3).reshape(-1)
+
+def quan_to_bytes(quan_array):
+    # Convert a uint8 array of quaternary symbols (4 per byte, MSB first) back to bytes
+    quan_array = np.asarray(quan_array, dtype=np.uint8).reshape(-1, 4)
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+    return np.bitwise_or.reduce(quan_array << shifts, axis=1).astype(np.uint8)
+
+def int_to_quan(values, quan_len):
+    # Convert integers to rows of quan_len quaternary digits (MSB first)
+    values = np.asarray(values, dtype=np.int64)
+    shifts = 2 * np.arange(quan_len - 1, -1, -1, dtype=np.int64)
+    return ((values[..., None] >> shifts) & 3).astype(np.uint8)
+
+def quan_to_int_array(quan_array):
+    # Convert rows of quaternary digits (MSB first) to integers
+    quan_array = np.asarray(quan_array, dtype=np.int64)
+    return quan_array @ (4 ** np.arange(quan_array.shape[-1] - 1, -1, -1, dtype=np.int64))
+
+def label_len(label_num):
+    # Number of bits of the labels of label_num items (addresses or file IDs), rounded up to whole quaternary symbols
+    bit_len = math.ceil(math.log2(label_num))
+    return bit_len + bit_len % 2
+
+def file_id_len(toatl_file_num):
+    # Number of ID bits; a single file still carries a one-symbol ID ('0', as written by Palette_enc)
+    return max(label_len(toatl_file_num), 2)
+
+def get_key(length_ary, key_str, key_length):
+    # Key word for DICOM, or a random key word of key_length seeded by key_str for others
+    if length_ary == 272:
+        return DICOM_KEY
+    random.seed(key_str)
+    return ''.join(random.choice('0123') for _ in range(key_length))
+
 def check_function(or_msg, dec_txt):
     """
     Check the number of differences between two strings.
@@ -75,7 +124,7 @@ def Palette_enc(binary_string, length_ary, id_num, toatl_file_num, key_str):
     Returns:
     - Codeword table, minus sequence number, length of the original binary string, code word length, and number of VT information bits.
     """
-    enc_table = []
+    word_table = []
     minus_num = 0
     b_len = math.ceil(math.log2(len(binary_string) / length_ary))  # Number of label positions
     if b_len % 2 != 0:
@@ -88,12 +137,7 @@ def Palette_enc(binary_string, length_ary, id_num, toatl_file_num, key_str):
 
     quan_id_index = quanternary_read(id_index)  # Current file index
 
-    if length_ary == 272: # Key word for DICOM
-        key = '02131213030120302130320121210321303132020231031021312031212021310123203010213120203012230303120121311032110320123020203131023031230121320301202132'
-    else:
-        random.seed(key_str)
-        key_length = (id_len + b_len + length_ary) // 2
-        key = ''.join(random.choice('0123') for _ in range(key_length)) # Key word for others
+    key = get_key(length_ary, key_str, (id_len + b_len + length_ary) // 2)
 
     ab_len = (length_ary // 2) // (b_len // 2)
     result_str = False
@@ -121,13 +165,10 @@ def Palette_enc(binary_string, length_ary, id_num, toatl_file_num, key_str):
             word_ab += ab_quan_str[(len(ab_quan_str) // len(quan_id_index)) * len(quan_id_index):]
 
             word_key = xor_encrypt(word_ab, key)
-            code_word, code_word_len0, k0 = vt_encode(word_key)
-            enc_table.append(code_word)
+            word_table.append(word_key)
             if not result_str:
                 a_len1 = len(a_quan_str)
                 b_len1 = len(b_quan_str)
-                code_word_len1 = code_word_len0
-                k1 = k0
                 result_str = True
 
     if len(binary_string) % length_ary != 0:
@@ -148,8 +189,13 @@ def Palette_enc(binary_string, length_ary, id_num, toatl_file_num, key_str):
                     ab_quan_str += a_quan_str[i]
             word_ab = quan_id_index + ab_quan_str
             word_key = xor_encrypt(word_ab, key)
-            code_word, code_word_len0, k0 = vt_encode(word_key)
-            enc_table.append(code_word)
+            word_table.append(word_key)
+
+    # VT encode all words of the file at once
+    word_array = np.frombuffer(''.join(word_table).encode(), dtype=np.uint8) - ord('0')
+    word_array = word_array.reshape(len(word_table), -1)
+    code_word_array, code_word_len1, k1 = vt_encode_batch(word_array)
+    enc_table = list(code_word_array)
     return enc_table, minus_num, len(binary_string), code_word_len1, k1
 
 
@@ -176,20 +222,20 @@ def Palette_dec(txt_table, length_ary, enc_binary_len_dic, code_word_len, vt_k,
 
     error_seq_num = 0
 
-    if length_ary == 272:
-        key = '02131213030120302130320121210321303132020231031021312031212021310123203010213120203012230303120121311032110320123020203131023031230121320301202132'
-    else:
-        random.seed(key_str)
-        key = ''.join(random.choice('0123') for _ in range(vt_k))
+    key = get_key(length_ary, key_str, vt_k)
 
     file_dic = {}
     dec_dic = {}
 
-    for i in range(len(txt_table)):
-        code_word0 = vt_decode(txt_table[i], code_word_len, vt_k)
-        ab_quan_len = (vt_k - id_len // 2) // (id_len // 2)
+    # VT decode all reads at once
+    dec_words, dec_fail = vt_decode_batch(txt_table, code_word_len, vt_k)
+    dec_bytes = (dec_words + ord('0')).astype(np.uint8).tobytes()
+    dec_width = dec_words.shape[1]
+    ab_quan_len = (vt_k - id_len // 2) // (id_len // 2)
 
-        if code_word0 is not None:
+    for i in range(len(txt_table)):
+        if not dec_fail[i]:
+            code_word0 = dec_bytes[dec_width * i:dec_width * (i + 1)].decode()
             code_word0 = xor_decrypt(code_word0, key)
             id_index = ''
             ab_quan_str = ''
@@ -244,4 +290,561 @@ def Palette_dec(txt_table, length_ary, enc_binary_len_dic, code_word_len, vt_k,
     #print("Number of failed VT decodings:", error_seq_num)
     return dec_dic
 
-    
\ No newline at end of file
+
+@functools.lru_cache(maxsize=32)
+def address_layout(length_ary, b_len):
+    """
+    Placement of the address symbols into the payload of a regular segment.
+
+    Parameters:
+    - length_ary: Radix.
+    - b_len: Number of label positions.
+
+    Returns:
+    - Gather index: ab_word = concatenate(payload, address)[index].
+    - Inverse index: concatenate(payload, address) = ab_word[inverse].
+    """
+    a_len = length_ary // 2
+    ab_len = a_len // (b_len // 2)
+    index = []
+    for t in range(b_len // 2):
+        index.extend(range(ab_len * t, ab_len * (t + 1)))
+        index.append(a_len + t)
+    index.extend(range(ab_len * (b_len // 2), a_len))
+    return _frozen_layout(index)
+
+
+@functools.lru_cache(maxsize=32)
+def id_layout(ab_word_len, id_len):
+    """
+    Placement of the ID symbols into a payload/address word.
+
+    Parameters:
+    - ab_word_len: Length of the payload/address word.
+    - id_len: Number of ID positions.
+
+    Returns:
+    - Gather index: word = concatenate(ab_word, id)[index].
+    - Inverse index: concatenate(ab_word, id) = word[inverse].
+    """
+    id_step = ab_word_len // (id_len // 2)
+    index = []
+    for t in range(id_len // 2):
+        index.append(ab_word_len + t)
+        index.extend(range(id_step * t, id_step * (t + 1)))
+    index.extend(range(id_step * (id_len // 2), ab_word_len))
+    return _frozen_layout(index)
+
+
+@functools.lru_cache(maxsize=32)
+def palette_layout(length_ary, b_len, id_len):
+    """
+    Word layout of Palette_enc for a file, as gather indices into concatenate(payload, address, id).
+
+    Parameters:
+    - length_ary: Radix.
+    - b_len: Number of label positions.
+    - id_len: Number of ID positions.
+
+    Returns:
+    - Gather index of the regular segments and gather index of the last, shorter segment.
+    """
+    a_len = length_ary // 2
+    ab_index = np.concatenate([address_layout(length_ary, b_len)[0],
+                               np.arange(a_len + b_len // 2, a_len + b_len // 2 + id_len // 2)])
+    index = ab_index[id_layout(a_len + b_len // 2, id_len)[0]]
+    # The last segment puts the ID first and alternates address and payload symbols
+    last_index = list(range(a_len + b_len // 2, a_len + b_len // 2 + id_len // 2))
+    for i in range(a_len):
+        if i < b_len // 2:
+            last_index.append(a_len + i)
+        last_index.append(i)
+    return _frozen_layout(index)[0], _frozen_layout(last_index)[0]
+
+
+def _frozen_layout(index):
+    # Layouts are shared through the caches above, so keep them read-only
+    index = np.array(index, dtype=np.int64)
+    inverse = np.argsort(index)
+    index.setflags(write=False)
+    inverse.setflags(write=False)
+    return index, inverse
+
+
+def Palette_enc_array(quan_array, length_ary, id_num, toatl_file_num, key_str, seg_start=0, binary_len=None):
+    """
+    Array-native version of Palette_enc, giving the same codewords.
+
+    Parameters:
+    - quan_array: uint8 array of quaternary symbols of the original sequence (see bytes_to_quan).
+    - length_ary: Radix.
+    - id_num: ID of the current file.
+    - toatl_file_num: Total number of files.
+    - key_str: Seed to determine the random key string.
+    - seg_start: Index of the first segment in quan_array, when encoding a shard of a file.
+    - binary_len: Length of the whole original binary string, when encoding a shard of a file.
+
+    Returns:
+    - Codeword array (one oligo per row, uint8), minus sequence number, length of the original binary string,
+      code word length, and number of VT information bits.
+    """
+    quan_array = np.asarray(quan_array, dtype=np.uint8)
+    if binary_len is None:
+        binary_len = 2 * len(quan_array)
+
+    a_len = length_ary // 2
+    seg_num = binary_len // length_ary
+    shard_seg_num = min(len(quan_array) // a_len, seg_num - seg_start)
+    segments = quan_array[:a_len * shard_seg_num].reshape(shard_seg_num, a_len)
+    nonzero = segments.any(axis=1)
+    minus_num = shard_seg_num - int(nonzero.sum())
+    a_quan = segments[nonzero]
+    seg_ids = seg_start + np.flatnonzero(nonzero)
+
+    # The last, shorter segment of the file
+    a_last = quan_array[a_len * shard_seg_num:]
+    if len(a_last) > 0 and seg_start + shard_seg_num == seg_num:
+        if not a_last.any():
+            minus_num += 1
+        else:
+            a_last = np.concatenate([a_last, np.zeros(a_len - len(a_last), dtype=np.uint8)])
+            a_quan = np.concatenate([a_quan, a_last[None, :]])
+            seg_ids = np.append(seg_ids, seg_num)
+
+    code_word_array, code_word_len, k = Palette_enc_segments(a_quan, seg_ids, length_ary, id_num, toatl_file_num,
+                                                             key_str, binary_len)
+    return code_word_array, minus_num, binary_len, code_word_len, k
+
+
+def Palette_enc_segments(a_quan, seg_ids, length_ary, id_num, toatl_file_num, key_str, binary_len):
+    """
+    Palette encode a sparse set of segments of a file, given by their addresses.
+
+    Parameters:
+    - a_quan: uint8 array of the payloads (one segment of length_ary // 2 symbols per row, the last, shorter
+      segment of the file zero padded).
+    - seg_ids: Addresses of the segments, in increasing order (binary_len // length_ary for the last segment).
+    - length_ary: Radix.
+    - id_num: ID of the current file.
+    - toatl_file_num: Total number of files.
+    - key_str: Seed to determine the random key string.
+    - binary_len: Length of the whole original binary string.
+
+    Returns:
+    - Codeword array (one oligo per row, uint8), code word length, and number of VT information bits.
+    """
+    a_quan = np.asarray(a_quan, dtype=np.uint8).reshape(len(seg_ids), length_ary // 2)
+    seg_ids = np.asarray(seg_ids, dtype=np.int64)
+    b_len = label_len(binary_len / length_ary)  # Number of label positions
+    id_len = file_id_len(toatl_file_num)
+    quan_id_index = int_to_quan(id_num, id_len // 2)  # Current file index
+
+    key = get_key(length_ary, key_str, (id_len + b_len + length_ary) // 2)
+    key = np.frombuffer(key.encode(), dtype=np.uint8) - ord('0')
+
+    # Place payload, address and ID symbols of all words with one gather
+    index, last_index = palette_layout(length_ary, b_len, id_len)
+    b_quan = int_to_quan(seg_ids, b_len // 2)
+    id_quan = np.broadcast_to(quan_id_index, (len(a_quan), len(quan_id_index)))
+    word_abc = np.concatenate([a_quan, b_quan, id_quan], axis=1)
+    word_ab = word_abc[:, index]
+
+    # The last, shorter segment uses its own layout (see Palette_enc)
+    is_last = seg_ids == binary_len // length_ary
+    if is_last.any():
+        word_ab[is_last] = word_abc[is_last][:, last_index]
+
+    word_len = min(word_ab.shape[1], len(key))
+    word_key = (word_ab[:, :word_len] + key[:word_len]) % 4
+    code_word_array, code_word_len, k = vt_encode_batch(word_key)
+    return code_word_array.astype(np.uint8), code_word_len, k
+
+
+def segment_mask(byte_array, length_ary):
+    """
+    Find the non-zero segments of a (RS encoded) file with one reduction over its bytes.
+
+    Parameters:
+    - byte_array: uint8 array of the file.
+    - length_ary: Radix (segment length in bits).
+
+    Returns:
+    - Boolean array with, for every address (the last, shorter segment included), whether its segment is non-zero.
+    """
+    units, unit_num = _segment_units(byte_array, length_ary)
+    full_num = len(units) // unit_num
+    mask = units[:full_num * unit_num].reshape(full_num, unit_num).any(axis=1)
+    if len(units) > full_num * unit_num:
+        mask = np.append(mask, units[full_num * unit_num:].any())
+    return mask
+
+
+def segment_rows(byte_array, seg_ids, length_ary):
+    """
+    Gather the payloads of the given segments of a file as quaternary symbols, without expanding the whole file.
+
+    Parameters:
+    - byte_array: uint8 array of the file.
+    - seg_ids: Addresses of the segments.
+    - length_ary: Radix (segment length in bits).
+
+    Returns:
+    - uint8 array of quaternary symbols, one segment per row (the last, shorter segment zero padded).
+    """
+    units, unit_num = _segment_units(byte_array, length_ary)
+    full_num = len(units) // unit_num
+    rows = np.zeros((len(seg_ids), unit_num), dtype=np.uint8)
+    seg_ids = np.asarray(seg_ids, dtype=np.int64)
+    is_full = seg_ids < full_num
+    rows[is_full] = units[:full_num * unit_num].reshape(full_num, unit_num)[seg_ids[is_full]]
+    tail = units[full_num * unit_num:]
+    rows[~is_full, :len(tail)] = tail
+    if unit_num == length_ary // 2:
+        return rows
+    return bytes_to_quan(rows.reshape(-1)).reshape(len(seg_ids), length_ary // 2)
+
+
+def _segment_units(byte_array, length_ary):
+    # Whole bytes per segment when possible, otherwise quaternary symbols
+    byte_array = np.asarray(byte_array, dtype=np.uint8)
+    if length_ary % 8 == 0:
+        return byte_array, length_ary // 8
+    return bytes_to_quan(byte_array), length_ary // 2
+
+
+def Palette_dec_records(txt_table, code_word_len, vt_k, toatl_file_num, key, lengths=None, quals=None):
+    """
+    VT decode reads and split each decoded word into its file ID and payload/address part.
+
+    Parameters:
+    - txt_table: Reads, as a list of symbol sequences (or a right padded 2-D array of reads, see lengths).
+    - code_word_len: Length of the code word.
+    - vt_k: VT information bits.
+    - toatl_file_num: Total number of files.
+    - key: Key word as a uint8 array of quaternary symbols.
+    - lengths: Read lengths, when txt_table is a padded 2-D array.
+    - quals: Phred base qualities of the reads (padded 2-D array like txt_table), for soft voting.
+
+    Returns:
+    - Array of file IDs, array of payload/address words (one per row, uint8), number of failed VT decodings,
+      the vote weights of the payload/address symbols (float32, same shape as the words; None without quals),
+      and a boolean mask of the reads that gave a record (VT decoded with a valid file ID).
+    """
+    id_len = file_id_len(toatl_file_num)
+
+    dec_words, dec_fail = vt_decode_batch(txt_table, code_word_len, vt_k, lengths)
+    error_seq_num = int(dec_fail.sum())
+    word_len = min(dec_words.shape[1], len(key))
+    ab_word_len = word_len - id_len // 2
+    id_nums, ab_words = split_words(dec_words[~dec_fail], key, ab_word_len, id_len)
+    keep = id_nums <= toatl_file_num - 1
+
+    ab_weights = None
+    if quals is not None:
+        if lengths is None:
+            quals, lengths = pad_rows(quals, code_word_len + 1)
+        quals = np.asarray(quals)[~dec_fail]
+        # Quality of the read base carrying each information symbol (approximate for reads with an indel)
+        ab_index = vt_systematic_index(code_word_len)[:word_len][id_layout(ab_word_len, id_len)[1][:ab_word_len]]
+        pos = np.minimum(ab_index, np.asarray(lengths)[~dec_fail, None] - 1)
+        ab_weights = phred_weight(np.take_along_axis(quals, np.maximum(pos, 0), axis=1))[keep]
+    decoded = np.zeros(len(dec_fail), dtype=bool)
+    decoded[np.flatnonzero(~dec_fail)[keep]] = True
+    if metrics.enabled():
+        for id_num, read_num in zip(*np.unique(id_nums[keep], return_counts=True)):
+            metrics.inc('palette_records', int(read_num), {'file': int(id_num)})
+        metrics.inc('palette_invalid_ids', int((~keep).sum()))
+    return id_nums[keep], ab_words[keep], error_seq_num, ab_weights, decoded
+
+
+def split_words(words, key, ab_word_len, id_len):
+    """
+    Remove the key from information words (one per row) and split them into file IDs and payload/address words.
+
+    Parameters:
+    - words: uint8 array of information words (quaternary symbols, the key added), at least
+      ab_word_len + id_len // 2 symbols wide.
+    - key: Key word as a uint8 array of quaternary symbols.
+    - ab_word_len: Length of the payload/address word.
+    - id_len: Number of ID positions.
+
+    Returns:
+    - Array of file IDs and array of payload/address words (one per row, uint8).
+    """
+    word_len = ab_word_len + id_len // 2
+    words = (words[:, :word_len].astype(np.uint8) + (4 - key[:word_len]).astype(np.uint8)) % 4
+    words = words[:, id_layout(ab_word_len, id_len)[1]]
+    return quan_to_int_array(words[:, ab_word_len:]), words[:, :ab_word_len]
+
+
+def phred_weight(quals):
+    # Vote weight of a base with Phred quality quals: log10 of the odds that it is right rather than a given wrong base
+    p_err = np.power(10.0, -np.maximum(np.asarray(quals, dtype=np.float32), 1.0) / 10)
+    return np.maximum(np.log10(3 * (1 - p_err) / p_err), 0).astype(np.float32)
+
+
+class VoteAccumulator:
+    def __init__(self, enc_binary_len, length_ary, expected=None):
+        """
+        Online per-bit majority vote over the addresses of one file.
+
+        Keeps, for every address, the number of votes and the number of 1 votes of every payload bit
+        (uint32, so up to 2**32 - 1 reads per address), plus the payload of the first read of the address to
+        break ties as Counter.most_common does. Memory depends on the number of addresses, not on coverage.
+        The vote margin of every address (smallest lead of the winning value over the losing one, over all
+        its bits) is kept up to date to decide when decoding can stop early (see resolved). Symbols added with
+        weight 0 abstain; the number of abstentions of every bit is only kept once there is one.
+
+        Parameters:
+        - enc_binary_len: Length of the original binary sequence of the file.
+        - length_ary: Radix.
+        - expected: Boolean mask of the addresses that have oligos (default: all addresses).
+        """
+        b_len = label_len(enc_binary_len / length_ary)
+        self.enc_binary_len = enc_binary_len
+        self.length_ary = length_ary
+        self.a_len = length_ary // 2
+        self.b_len = b_len
+        self.seg_num = math.ceil(enc_binary_len / length_ary)
+        self.inverse = address_layout(length_ary, b_len)[1]
+        self.counts = np.zeros(self.seg_num, dtype=np.uint32)
+        self.ones = np.zeros((self.seg_num, length_ary), dtype=np.uint32)
+        self.first = np.zeros((self.seg_num, self.a_len), dtype=np.uint8)
+        self.margin = np.zeros(self.seg_num, dtype=np.float32)
+        self.abstain = None
+        if expected is None:
+            expected = np.ones(self.seg_num, dtype=bool)
+        self.expected = np.asarray(expected, dtype=bool)
+
+    def add(self, ab_words, ab_weights=None):
+        """
+        Add the votes of payload/address words of the file (one per row, uint8), in read order. ab_weights
+        (0 or 1 per symbol, same shape as the words) leaves out the payload symbols of weight 0.
+        """
+        ab_words = ab_words[:, self.inverse]
+        b_index = quan_to_int_array(ab_words[:, self.a_len:])
+        a_quan = ab_words[:, :self.a_len]
+        keep = b_index < self.seg_num
+        b_index, a_quan = b_index[keep], a_quan[keep]
+        if ab_weights is not None:
+            a_weights = np.asarray(ab_weights, dtype=np.uint8)[:, self.inverse][keep, :self.a_len]
+
+        order = np.argsort(b_index, kind='stable')
+        b_unique, first, counts = np.unique(b_index[order], return_index=True, return_counts=True)
+        if len(b_unique) == 0:
+            return
+        a_quan = a_quan[order]
+        new = self.counts[b_unique] == 0
+        self.first[b_unique[new]] = a_quan[first[new]]
+        a_bits = np.stack([a_quan // 2, a_quan % 2], axis=2).reshape(a_quan.shape[0], self.length_ary)
+        if ab_weights is not None and not a_weights.all():
+            if self.abstain is None:
+                self.abstain = np.zeros(self.ones.shape, dtype=np.uint32)
+            bit_weights = np.repeat(a_weights[order], 2, axis=1)
+            a_bits = a_bits * bit_weights
+            self.abstain[b_unique] += np.add.reduceat(1 - bit_weights, first, axis=0, dtype=np.uint32)
+        self.ones[b_unique] += np.add.reduceat(a_bits, first, axis=0, dtype=np.uint32)
+        self.counts[b_unique] += counts.astype(np.uint32)
+        self._update_margin(b_unique)
+
+    def _bit_counts(self, rows):
+        # Number of votes of every bit of the given addresses
+        counts = self.counts[rows].astype(np.int64)[:, None]
+        if self.abstain is None:
+            return counts
+        return counts - self.abstain[rows]
+
+    def _update_margin(self, rows):
+        # Vote margin of the given addresses: smallest |ones - zeros| over their bits
+        twice_ones = 2 * self.ones[rows].astype(np.int64)
+        self.margin[rows] = np.abs(twice_ones - self._bit_counts(rows)).min(axis=1)
+
+    def resolved(self, margin):
+        """
+        Whether every expected address has been read and all its bits lead by at least margin votes.
+        """
+        return bool(np.all(self.margin[self.expected] >= margin) and np.all(self.counts[self.expected] > 0))
+
+    def _vote_bits(self, rows):
+        # Majority vote of every bit of the given addresses, ties go to the first read of the address
+        twice_ones = 2 * self.ones[rows].astype(np.int64)
+        counts = self._bit_counts(rows)
+        first_bits = np.stack([self.first[rows] // 2, self.first[rows] % 2], axis=2).reshape(len(counts), -1)
+        return np.where(twice_ones > counts, 1, np.where(twice_ones < counts, 0, first_bits)).astype(np.uint8)
+
+    def consensus_rows(self, rows):
+        """
+        Current consensus payloads of the given addresses, as uint8 quaternary symbols (one address per row).
+        """
+        dec_bits = self._vote_bits(np.asarray(rows, dtype=np.int64))
+        return (2 * dec_bits[:, 0::2] + dec_bits[:, 1::2]).astype(np.uint8)
+
+    def finalize(self):
+        """
+        Majority vote of every bit, ties go to the first read of the address; addresses without reads are zero.
+
+        Returns:
+        - uint8 array of quaternary symbols of the decoded file (enc_binary_len // 2 symbols).
+        """
+        dec_bits = self._vote_bits(np.arange(self.seg_num)).reshape(-1)[:self.enc_binary_len]
+        return (2 * dec_bits[0::2] + dec_bits[1::2]).astype(np.uint8)
+
+
+class SoftVoteAccumulator(VoteAccumulator):
+    def __init__(self, enc_binary_len, length_ary, expected=None):
+        """
+        Online quality-weighted per-bit vote over the addresses of one file.
+
+        Every symbol votes for its two bits with its weight (see phred_weight); the weights of 1 votes and of
+        all votes of every bit are kept in dense uint32 arrays, in units of 1 / WEIGHT_SCALE, so that equal
+        weights add up exactly and ties still go to the first read of the address (up to about 3.7 million Q40
+        reads per address). Vote margins are in weight units instead of reads.
+
+        Parameters:
+        - enc_binary_len: Length of the original binary sequence of the file.
+        - length_ary: Radix.
+        - expected: Boolean mask of the addresses that have oligos (default: all addresses).
+        """
+        super().__init__(enc_binary_len, length_ary, expected)
+        self.ones = np.zeros((self.seg_num, length_ary), dtype=np.uint32)
+        self.totals = np.zeros((self.seg_num, length_ary), dtype=np.uint32)
+
+    def add(self, ab_words, ab_weights):
+        """
+        Add the weighted votes of payload/address words of the file (one per row, uint8), in read order.
+        """
+        ab_words = ab_words[:, self.inverse]
+        ab_weights = ab_weights[:, self.inverse]
+        b_index = quan_to_int_array(ab_words[:, self.a_len:])
+        keep = b_index < self.seg_num
+        b_index, a_quan, a_weights = b_index[keep], ab_words[keep, :self.a_len], ab_weights[keep, :self.a_len]
+
+        order = np.argsort(b_index, kind='stable')
+        b_unique, first, counts = np.unique(b_index[order], return_index=True, return_counts=True)
+        if len(b_unique) == 0:
+            return
+        a_quan, a_weights = a_quan[order], a_weights[order]
+        new = self.counts[b_unique] == 0
+        self.first[b_unique[new]] = a_quan[first[new]]
+        a_bits = np.stack([a_quan // 2, a_quan % 2], axis=2).reshape(a_quan.shape[0], self.length_ary)
+        bit_weights = np.repeat(np.rint(a_weights * WEIGHT_SCALE).astype(np.uint32), 2, axis=1)
+        self.ones[b_unique] += np.add.reduceat(a_bits * bit_weights, first, axis=0, dtype=np.uint32)
+        self.totals[b_unique] += np.add.reduceat(bit_weights, first, axis=0, dtype=np.uint32)
+        self.counts[b_unique] += counts.astype(np.uint32)
+        self._update_margin(b_unique)
+
+    def _update_margin(self, rows):
+        # Weighted vote margin of the given addresses, in weight units
+        twice_ones = 2 * self.ones[rows].astype(np.int64)
+        self.margin[rows] = np.abs(twice_ones - self.totals[rows]).min(axis=1) / WEIGHT_SCALE
+
+    def _vote_bits(self, rows):
+        # Weighted vote of every bit of the given addresses, ties go to the first read of the address
+        twice_ones = 2 * self.ones[rows].astype(np.int64)
+        totals = self.totals[rows].astype(np.int64)
+        first_bits = np.stack([self.first[rows] // 2, self.first[rows] % 2], axis=2).reshape(len(totals), -1)
+        return np.where(twice_ones > totals, 1, np.where(twice_ones < totals, 0, first_bits)).astype(np.uint8)
+
+
+def pack_bitmap(mask):
+    """
+    Boolean mask as a compact base64 text bitmap (8 entries per byte, first entry in the high bit).
+    """
+    return base64.b64encode(np.packbits(np.asarray(mask, dtype=bool)).tobytes()).decode()
+
+
+def unpack_bitmap(bitmap, length):
+    """
+    Boolean mask of the given length from a bitmap written by pack_bitmap.
+    """
+    return np.unpackbits(np.frombuffer(base64.b64decode(bitmap), dtype=np.uint8))[:length].astype(bool)
+
+
+def coverage_report(accumulator_dic, enc_binary_len_dic, length_ary, expected_dic=None):
+    """
+    Per-file report of the addresses recovered by decoding and of those missing.
+
+    An address is recovered when at least one read voted for it. Addresses without oligos (all-zero segments
+    skipped at encoding, given by expected_dic) are neither recovered nor missing.
+
+    Parameters:
+    - accumulator_dic: Dictionary of the vote accumulators of the decoded files, by file ID.
+    - enc_binary_len_dic: Dictionary containing the length of the original binary sequence for each file.
+    - length_ary: Radix.
+    - expected_dic: Dictionary with, for each file, a boolean mask of the addresses that have oligos
+      (default: all addresses of the file).
+
+    Returns:
+    - Dictionary with, for each file of enc_binary_len_dic, a JSON serializable dictionary: number of addresses,
+      of addresses with oligos, of recovered and of missing ones, bitmap of the missing addresses (pack_bitmap,
+      see missing_addresses) and coverage histogram (entry c is the number of addresses with oligos read c times).
+    """
+    if expected_dic is None:
+        expected_dic = {}
+    report_dic = {}
+    for id_num, enc_binary_len in enc_binary_len_dic.items():
+        seg_num = math.ceil(enc_binary_len / length_ary)
+        expected = expected_dic.get(id_num)
+        expected = np.ones(seg_num, dtype=bool) if expected is None else np.asarray(expected, dtype=bool)
+        if id_num in accumulator_dic:
+            counts = accumulator_dic[id_num].counts.astype(np.int64)
+        else:
+            counts = np.zeros(seg_num, dtype=np.int64)
+        missing = expected & (counts == 0)
+        report_dic[id_num] = {'segment_num': seg_num, 'expected_num': int(expected.sum()),
+                              'recovered_num': int((expected & (counts > 0)).sum()),
+                              'missing_num': int(missing.sum()), 'missing_bitmap': pack_bitmap(missing),
+                              'coverage_histogram': np.bincount(counts[expected]).tolist()}
+    return report_dic
+
+
+def missing_addresses(file_report):
+    """
+    Addresses missing after decoding, from a file entry of coverage_report.
+    """
+    return np.flatnonzero(unpack_bitmap(file_report['missing_bitmap'], file_report['segment_num']))
+
+
+def Palette_vote_file(ab_words, enc_binary_len, length_ary):
+    """
+    Split payload/address words of one file, majority vote per address and rebuild the file.
+
+    Parameters:
+    - ab_words: Payload/address words of the file (one per row, uint8), in read order.
+    - enc_binary_len: Length of the original binary sequence of the file.
+    - length_ary: Radix.
+
+    Returns:
+    - uint8 array of quaternary symbols of the decoded file (enc_binary_len // 2 symbols).
+    """
+    accumulator = VoteAccumulator(enc_binary_len, length_ary)
+    accumulator.add(ab_words)
+    return accumulator.finalize()
+
+
+def Palette_dec_array(txt_table, length_ary, enc_binary_len_dic, code_word_len, vt_k, toatl_file_num, key_str):
+    """
+    Array-native version of Palette_dec, giving the same decoded files.
+
+    Parameters:
+    - txt_table: Table where each entry is a sequence of read symbols.
+    - length_ary: Radix.
+    - enc_binary_len_dic: Dictionary containing the length of the original binary sequence for each file.
+    - code_word_len: Length of the code word.
+    - vt_k: VT information bits.
+    - toatl_file_num: Total number of files.
+    - key_str: Key string.
+
+    Returns:
+    - Dictionary containing the decoded sequence of each file as a uint8 array of quaternary symbols.
+    """
+    key = get_key(length_ary, key_str, vt_k)
+    key = np.frombuffer(key.encode(), dtype=np.uint8) - ord('0')
+    id_nums, ab_words, error_seq_num = Palette_dec_records(txt_table, code_word_len, vt_k, toatl_file_num, key)[:3]
+
+    dec_dic = {}
+    for id_num in np.unique(id_nums):
+        dec_dic[int(id_num)] = Palette_vote_file(ab_words[id_nums == id_num], enc_binary_len_dic[int(id_num)],
+                                                 length_ary)
+    #print("Number of failed VT decodings:", error_seq_num)
+    return dec_dic
@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import resource
+import platform
+import numpy as np
+from DNA_Ladder_code import rs_encode_array, rs_decode_array
+from Palette_enc_dec import Palette_enc_segments, quan_to_bytes, segment_mask, segment_rows
+from channel_error import Error, ragged_chunks
+from parallel_codec import parallel_decode_stream
+
+
+def random_payloads(file_num, size_range=(263000, 300000), seed=0):
+    """
+    Random payloads sized like the DICOM slices.
+
+    Parameters:
+    - file_num: Number of payloads.
+    - size_range: Smallest and largest payload size in bytes.
+    - seed: Seed of the payload generator.
+
+    Returns:
+    - List of payloads (bytearray, like read_file).
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(size_range[0], size_range[1] + 1, file_num)
+    return [bytearray(rng.integers(0, 256, size, dtype=np.uint8).tobytes()) for size in sizes]
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size so far of this process and of its finished worker processes, in MB.
+    """
+    scale = 1 / 1024 if sys.platform != 'darwin' else 1 / 1024 ** 2  # ru_maxrss is in KB on Linux, bytes on macOS
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+
+def benchmark_encode(payloads, str_len, key_word, workers=1):
+    """
+    RS and Palette encode payloads, timing each stage.
+
+    Parameters:
+    - payloads: List of payloads (bytearray), in file ID order.
+    - str_len: Length of the a sequence (in quaternary symbols).
+    - key_word: Seed to determine the random key string.
+    - workers: Number of processes encoding the RS columns.
+
+    Returns:
+    - Encoding results: codeword array of every file, length of the RS encoded binary string of every file,
+      non-zero segment mask of every file, code word length and number of VT information bits.
+    - Stage report dictionary.
+    """
+    length_ary = str_len * 2
+    a_len = str_len // 4
+
+    start = time.perf_counter()
+    rs_list = [rs_encode_array(payload, a_len, workers)[0] for payload in payloads]
+    rs_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    codeword_list, mask_list = [], []
+    for id_num, rs_enc in enumerate(rs_list):
+        mask = segment_mask(rs_enc, length_ary)
+        seg_ids = np.flatnonzero(mask)
+        codewords, code_word_len, vt_k = Palette_enc_segments(segment_rows(rs_enc, seg_ids, length_ary), seg_ids,
+                                                              length_ary, id_num, len(payloads), key_word,
+                                                              8 * len(rs_enc))
+        codeword_list.append(codewords)
+        mask_list.append(mask)
+    palette_time = time.perf_counter() - start
+
+    oligo_num = sum(len(codewords) for codewords in codeword_list)
+    report = {'file_num': len(payloads), 'byte_num': sum(len(payload) for payload in payloads),
+              'oligo_num': oligo_num, 'code_word_len': int(code_word_len), 'vt_k': int(vt_k),
+              'rs_encode_s': rs_time, 'palette_encode_s': palette_time,
+              'oligos_per_s': oligo_num / max(palette_time, 1e-9), 'peak_rss_mb': peak_rss_mb()}
+    enc = (codeword_list, [8 * len(rs_enc) for rs_enc in rs_list], mask_list, code_word_len, vt_k)
+    return enc, report
+
+
+def benchmark_decode(payloads, enc, str_len, key_word, coverage, error_rate, dropout=0.0, seed=0, workers=1,
+                     chunk_size=100000, salvage=False, cluster=False):
+    """
+    Simulate sequencing of the encoded payloads and decode the reads, timing each stage.
+
+    Parameters:
+    - payloads: List of payloads (bytearray), in file ID order.
+    - enc: Encoding results of benchmark_encode.
+    - str_len: Length of the a sequence (in quaternary symbols).
+    - key_word: Seed to determine the random key string.
+    - coverage: Number of reads sampled per oligo.
+    - error_rate: Per-base error probability, split equally between substitutions, deletions and insertions.
+    - dropout: Probability that an oligo is not sampled.
+    - seed: Seed of the channel simulator.
+    - workers: Number of decoding processes.
+    - chunk_size: Number of reads decoded at a time.
+    - salvage: Run the salvage pass of parallel_decode_stream.
+    - cluster: Cluster reads before VT decoding in parallel_decode_stream.
+
+    Returns:
+    - Stage report dictionary.
+    """
+    codeword_list, enc_binary_len_list, mask_list, code_word_len, vt_k = enc
+    file_num = len(payloads)
+    enc_binary_len_dic = dict(enumerate(enc_binary_len_list))
+    file_len_dic = {id_num: len(payload) for id_num, payload in enumerate(payloads)}
+
+    start = time.perf_counter()
+    error = Error(np.concatenate(codeword_list), dropout, error_rate / 3, error_rate / 3, error_rate / 3, seed)
+    flat, offsets = error.random_sample_batch(coverage, workers)
+    channel_time = time.perf_counter() - start
+    read_num = len(offsets) - 1
+
+    start = time.perf_counter()
+    dec_dic, _, coverage_dic = parallel_decode_stream(
+        ragged_chunks(flat, offsets, code_word_len + 1, chunk_size), str_len * 2, enc_binary_len_dic, code_word_len,
+        vt_k, file_num, key_word, workers, expected_dic=dict(enumerate(mask_list)), salvage=salvage, cluster=cluster)
+    palette_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dec_dic = {id_num: quan_to_bytes(dec_quan) for id_num, dec_quan in dec_dic.items()}
+    missing = [id_num for id_num in range(file_num) if id_num not in dec_dic]
+    for id_num in missing:
+        dec_dic[id_num] = np.zeros(enc_binary_len_list[id_num] // 8, dtype=np.uint8)
+    rs_dec_dic = rs_decode_array(dec_dic, file_len_dic, str_len // 4, workers)
+    rs_time = time.perf_counter() - start
+
+    error_byte_num = 0
+    recovered_num = 0
+    for id_num, payload in enumerate(payloads):
+        error_byte = int(np.count_nonzero(np.frombuffer(payload, dtype=np.uint8) != rs_dec_dic[id_num]))
+        error_byte_num += error_byte
+        recovered_num += error_byte == 0
+    return {'coverage': coverage, 'error_rate': error_rate, 'dropout': dropout, 'seed': seed,
+            'read_num': read_num, 'channel_s': channel_time, 'palette_decode_s': palette_time,
+            'rs_decode_s': rs_time, 'reads_per_s': read_num / max(palette_time, 1e-9),
+            'missing_addresses': sum(report['missing_num'] for report in coverage_dic.values()),
+            'recovered_files': recovered_num, 'recovery_rate': recovered_num / file_num,
+            'byte_error_rate': error_byte_num / sum(file_len_dic.values()), 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_benchmark(out_path, file_num=4, size_range=(263000, 300000), coverages=(5, 10), error_rates=(0.003, 0.01),
+                  dropout=0.0, str_len=136, key_word=1, seed=0, workers=1, chunk_size=100000, salvage=False,
+                  cluster=False):
+    """
+    Encode random payloads once, then simulate and decode them for every coverage and error rate of the grids,
+    and write the report as JSON.
+
+    Peak RSS is the high-water mark of the process so far (getrusage), so it never decreases along the grid.
+
+    Parameters:
+    - out_path: JSON report file name.
+    - file_num: Number of payloads.
+    - size_range: Smallest and largest payload size in bytes.
+    - coverages: Coverage grid.
+    - error_rates: Per-base error rate grid.
+    - dropout: Probability that an oligo is not sampled.
+    - str_len: Length of the a sequence (in quaternary symbols).
+    - key_word: Seed to determine the random key string.
+    - seed: Seed of the payloads and of the channel simulator.
+    - workers: Number of processes.
+    - chunk_size: Number of reads decoded at a time.
+    - salvage: Run the salvage pass when decoding.
+    - cluster: Cluster reads before VT decoding.
+
+    Returns:
+    - Report dictionary.
+    """
+    config = {'file_num': file_num, 'size_range': list(size_range), 'coverages': list(coverages),
+              'error_rates': list(error_rates), 'dropout': dropout, 'str_len': str_len, 'key': key_word,
+              'seed': seed, 'workers': workers, 'chunk_size': chunk_size, 'salvage': salvage, 'cluster': cluster}
+    payloads = random_payloads(file_num, size_range, seed)
+    enc, encode_report = benchmark_encode(payloads, str_len, key_word, workers)
+    print("Encoded {:d} oligos in {:.2f} s".format(encode_report['oligo_num'],
+                                                  encode_report['rs_encode_s'] + encode_report['palette_encode_s']))
+
+    runs = []
+    for coverage in coverages:
+        for error_rate in error_rates:
+            run = benchmark_decode(payloads, enc, str_len, key_word, coverage, error_rate, dropout, seed, workers,
+                                   chunk_size, salvage, cluster)
+            print("Coverage {}, error rate {}: {:d}/{:d} files recovered, {:.0f} reads/s".format(
+                coverage, error_rate, run['recovered_files'], file_num, run['reads_per_s']))
+            runs.append(run)
+
+    report = {'config': config,
+              'platform': {'python': platform.python_version(), 'numpy': np.__version__,
+                           'machine': platform.machine(), 'cpu_count': os.cpu_count()},
+              'encode': encode_report, 'runs': runs}
+    with open(out_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+if __name__ == '__main__':
+    # Payloads: random bytes sized like the DICOM slices
+    file_num = 4
+    size_range = (263000, 300000)
+
+    # Grids: reads per oligo, and per-base error rate split equally between substitutions, deletions and insertions
+    coverages = (5, 10)
+    error_rates = (0.003, 0.01)
+    dropout = 0.0
+
+    # Codec and run settings
+    str_len = 136
+    key_word = 1
+    seed = 0
+    workers = 1  # Number of processes, None uses all CPUs and 1 runs serially
+    chunk_size = 100000
+    salvage = False
+    cluster = False
+    out_path = "./benchmark.json"
+
+    run_benchmark(out_path, file_num, size_range, coverages, error_rates, dropout, str_len, key_word, seed,
+                  workers, chunk_size, salvage, cluster)
@@ -6,27 +6,31 @@ Created on Sat Oct 23 15:17:35 2021
 @author: serena-mo
 """
 
+import math
 import numpy as np
 import random
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 class Error:
-    def __init__(self, strands, pr, sub_pr, del_pr, ins_pr):
+    def __init__(self, strands, pr, sub_pr, del_pr, ins_pr, seed=None):
         """
         Initialize the Error class.
 
         Parameters:
-        - strands: List of input sequences (each sequence is a NumPy array).
+        - strands: List of input sequences (each sequence is a NumPy array), or a 2-D array (one per row).
         - pr: Probability of dropout (sequence not sampled).
         - sub_pr: Probability of substitution error.
         - ins_pr: Probability of insertion error.
         - del_pr: Probability of deletion error.
+        - seed: Seed of the batched simulator (random_sample_batch), None for a random seed.
         """
         self.strands = strands
         self.pr = pr
         self.sub_pr = sub_pr
         self.ins_pr = ins_pr
         self.del_pr = del_pr
+        self.seed = seed
 
     def random_error(self, y):
         """
@@ -116,4 +120,131 @@ class Error:
 
 
  
-       
\ No newline at end of file
+       
+    def random_sample_batch(self, sample_times: int, workers=1, shard_size=100000):
+        """
+        Batched version of random_sample: dropout, insertion, deletion and substitution events are drawn for
+        whole shards of strands at once with numpy Generators.
+
+        The error model is the one of random_error: before each base a geometric number of random bases is
+        inserted, then the base is deleted, or else substituted by one of the 3 other bases. Every shard of
+        shard_size strands has its own random stream (spawned from seed), so the output only depends on seed
+        and shard_size, not on the number of worker processes.
+
+        Parameters:
+        - sample_times: Number of samples to generate.
+        - workers: Number of worker processes simulating shards.
+        - shard_size: Number of strands per shard.
+
+        Returns:
+        - flat: uint8 array of all sampled sequences with random errors applied, concatenated in shuffled order.
+        - offsets: int64 array of sequence boundaries (sequence i is flat[offsets[i]:offsets[i + 1]]).
+        """
+        flat, lengths = _flatten_strands(self.strands)
+        strand_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        shard_num = max(1, math.ceil(len(lengths) / shard_size))
+        shuffle_seed, *shard_seeds = np.random.SeedSequence(self.seed).spawn(shard_num + 1)
+        probs = (self.pr, self.sub_pr, self.del_pr, self.ins_pr)
+
+        shard_args = []
+        for shard in range(shard_num):
+            start, end = shard * shard_size, min((shard + 1) * shard_size, len(lengths))
+            shard_args.append((flat[strand_offsets[start]:strand_offsets[end]], lengths[start:end], sample_times,
+                               probs, shard_seeds[shard]))
+        if workers == 1 or shard_num == 1:
+            results = [_sample_shard(*args) for args in shard_args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_sample_shard, *zip(*shard_args)))
+
+        out_flat = np.concatenate([result[0] for result in results])
+        out_lengths = np.concatenate([result[1] for result in results])
+        total_sub_num, total_del_num, total_ins_num, ex_error_seq, dropout_times = \
+            np.sum([result[2] for result in results], axis=0)
+        print("Number of sequences with more than two insertions, deletions, or substitutions:", ex_error_seq)
+        print("Number of dropped sequences:", dropout_times)
+        print("Total number of substitution/deletion/insertion errors:", total_sub_num, total_del_num, total_ins_num)
+
+        # Shuffle the sampled sequences with one gather
+        order = np.random.default_rng(shuffle_seed).permutation(len(out_lengths))
+        return _gather_ragged(out_flat, out_lengths, order)
+
+
+def ragged_chunks(flat, offsets, width, chunk_size=100000):
+    """
+    Split ragged sequences into right padded chunks, as read_stream.read_chunks yields them.
+
+    Parameters:
+    - flat: uint8 array of concatenated sequences.
+    - offsets: Sequence boundaries (see Error.random_sample_batch).
+    - width: Width of the chunk arrays; longer sequences are truncated but keep their true length.
+    - chunk_size: Maximum number of sequences per chunk.
+
+    Yields:
+    - uint8 array of sequences (chunk x width) and int64 array of sequence lengths.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    for start in range(0, len(offsets) - 1, chunk_size):
+        starts = offsets[start:start + chunk_size + 1]
+        lengths = np.diff(starts)
+        cols = np.arange(width)
+        keep = cols[None, :] < lengths[:, None]
+        index = np.minimum(starts[:-1, None] + cols[None, :], max(len(flat) - 1, 0))
+        yield np.where(keep, flat[index] if len(flat) else 0, 0).astype(np.uint8), lengths
+
+
+def _flatten_strands(strands):
+    # Concatenate the strands into one uint8 array with their lengths
+    if isinstance(strands, np.ndarray) and strands.ndim == 2:
+        return strands.astype(np.uint8).reshape(-1), np.full(len(strands), strands.shape[1], dtype=np.int64)
+    lengths = np.array([len(strand) for strand in strands], dtype=np.int64)
+    if len(strands) == 0:
+        return np.zeros(0, dtype=np.uint8), lengths
+    return np.concatenate([np.asarray(strand, dtype=np.uint8) for strand in strands]), lengths
+
+
+def _gather_ragged(flat, lengths, order):
+    # Reorder ragged sequences, returns the new flat array and offsets
+    starts = np.cumsum(lengths) - lengths
+    new_lengths = lengths[order]
+    new_offsets = np.concatenate([[0], np.cumsum(new_lengths)]).astype(np.int64)
+    index = np.repeat(starts[order] - new_offsets[:-1], new_lengths) + np.arange(new_offsets[-1])
+    return flat[index], new_offsets
+
+
+def _sample_shard(flat, lengths, sample_times, probs, seed_seq):
+    # Sample a shard of strands sample_times times with dropout, then apply the channel errors to every copy
+    pr, sub_pr, del_pr, ins_pr = probs
+    rng = np.random.default_rng(seed_seq)
+
+    strand_num = len(lengths)
+    copies = np.repeat(np.arange(strand_num), sample_times)
+    keep = np.round(rng.random(len(copies)), 5) >= pr
+    dropout_times = int(len(copies) - keep.sum())
+    copies = copies[keep]
+
+    # Bases of all sampled copies, in copy order
+    starts = np.cumsum(lengths) - lengths
+    copy_lengths = lengths[copies]
+    copy_starts = np.cumsum(copy_lengths) - copy_lengths
+    base_num = int(copy_lengths.sum())
+    y = flat[np.repeat(starts[copies] - copy_starts, copy_lengths) + np.arange(base_num)]
+
+    # Per base: geometric number of insertions, then deletion or substitution
+    ins_count = rng.geometric(1 - ins_pr, base_num) - 1 if ins_pr > 0 else np.zeros(base_num, dtype=np.int64)
+    deleted = rng.random(base_num) <= del_pr
+    substituted = ~deleted & (rng.random(base_num) <= sub_pr)
+    y = np.where(substituted, (y + rng.integers(1, 4, base_num)) % 4, y).astype(np.uint8)
+
+    out_count = ins_count + ~deleted
+    out_start = np.cumsum(out_count) - out_count
+    out = rng.integers(0, 4, int(out_count.sum()), dtype=np.uint8)  # Inserted bases
+    out[(out_start + ins_count)[~deleted]] = y[~deleted]
+
+    # Per copy: output length and error counts
+    copy_index = np.repeat(np.arange(len(copies)), copy_lengths)
+    out_lengths = np.bincount(copy_index, weights=out_count, minlength=len(copies)).astype(np.int64)
+    error_num = np.bincount(copy_index, weights=ins_count + deleted + substituted, minlength=len(copies))
+    stats = (int(substituted.sum()), int(deleted.sum()), int(ins_count.sum()), int((error_num >= 2).sum()),
+             dropout_times)
+    return out, out_lengths, stats
@@ -0,0 +1,344 @@
+import numpy as np
+from vt_enc import vt_systematic_index
+from Palette_enc_dec import Palette_dec_records, address_layout, file_id_len, label_len, split_words
+
+SIGNATURE_BLOCK = 4096  # Reads hashed at a time (see read_signatures)
+KMER_HASH = 0x9E3779B1  # Odd multiplier of the k-mer hash
+VOTE_BLOCK = 4096  # Clusters voted at a time (see cluster_reads)
+
+
+def read_signatures(reads, lengths, k=16, block=SIGNATURE_BLOCK):
+    """
+    Minimizer signature of every read, shared by most reads of an oligo.
+
+    The k-mers of a read (2k-bit codes, computed blockwise in uint32) are hashed with a multiplicative hash,
+    and the signature is the smallest hash. An error of any kind changes the signature only if it falls into
+    the minimizer k-mer, so reads with a substitution or an indel elsewhere keep the signature of their oligo,
+    while reads of different oligos share one only if they share that k-mer.
+
+    Parameters:
+    - reads: Right padded uint8 array of reads (one per row).
+    - lengths: Read lengths.
+    - k: k-mer length (at most 16).
+    - block: Number of reads hashed at a time.
+
+    Returns:
+    - int64 array of signatures (-1 for reads shorter than k).
+    """
+    reads = np.asarray(reads, dtype=np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    kmer_num = reads.shape[1] - k + 1
+    signatures = np.full(len(lengths), -1, dtype=np.int64)
+    for start in range(0, len(lengths), block):
+        block_reads = reads[start:start + block]
+        hashes = np.zeros((len(block_reads), kmer_num), dtype=np.uint32)
+        for offset in range(k):
+            hashes <<= np.uint32(2)
+            hashes |= block_reads[:, offset:offset + kmer_num]
+        hashes *= np.uint32(KMER_HASH)
+        hashes ^= hashes >> np.uint32(16)
+        # k-mers running into the padding never win
+        hashes[np.arange(kmer_num)[None, :] > lengths[start:start + block, None] - k] = np.iinfo(np.uint32).max
+        signatures[start:start + block] = hashes.min(axis=1)
+    signatures[lengths < k] = -1
+    return signatures
+
+
+class ReadBuckets:
+    def __init__(self, bucket_size=16, max_buffered=1000000, batch_size=100000, k=16):
+        """
+        Reads of a stream bucketed by signature (see read_signatures) across chunks, for Palette_dec_clustered.
+
+        A bucket is spilled as soon as it holds bucket_size reads, so a cluster gathers the reads of its oligo
+        from any chunk but stays bounded; reads without a signature are spilled right away. When more than
+        max_buffered reads are buffered every bucket is spilled, and flush spills the remaining ones at the end
+        of the stream. Spilled reads come in batches of whole buckets of about batch_size reads, in stream
+        order within a batch.
+
+        Parameters:
+        - bucket_size: Number of reads of a signature spilled together.
+        - max_buffered: Maximum number of buffered reads.
+        - batch_size: Number of reads per spilled batch.
+        - k: k-mer length of the signatures.
+        """
+        self.bucket_size = bucket_size
+        self.max_buffered = max_buffered
+        self.batch_size = batch_size
+        self.k = k
+        self._parts = []
+
+    def add(self, reads, lengths, quals=None):
+        """
+        Buffer a chunk of reads (with their Phred qualities, if any) and spill the full buckets.
+
+        Returns:
+        - List of spilled batches (reads, lengths, qualities or None, signatures).
+        """
+        reads, lengths = np.asarray(reads, dtype=np.uint8), np.asarray(lengths, dtype=np.int64)
+        self._parts.append((reads, lengths, quals, read_signatures(reads, lengths, self.k)))
+        reads, lengths, quals, signatures = self._take()
+        if len(lengths) > self.max_buffered:
+            spill = np.ones(len(lengths), dtype=bool)
+        else:
+            inverse, counts = np.unique(signatures, return_inverse=True, return_counts=True)[1:]
+            spill = (counts[inverse.reshape(-1)] >= self.bucket_size) | (signatures < 0)
+        keep = ~spill
+        self._parts = [(reads[keep], lengths[keep], None if quals is None else quals[keep], signatures[keep])]
+        return self._batches(reads[spill], lengths[spill], None if quals is None else quals[spill], signatures[spill])
+
+    def flush(self):
+        """
+        Spill all buffered reads, in batches like add.
+        """
+        if not self._parts:
+            return []
+        return self._batches(*self._take())
+
+    def _take(self):
+        # All buffered reads, emptying the buffer
+        reads, lengths, quals, signatures = zip(*self._parts)
+        self._parts = []
+        quals = None if quals[0] is None else np.concatenate(quals)
+        return np.concatenate(reads), np.concatenate(lengths), quals, np.concatenate(signatures)
+
+    def _batches(self, reads, lengths, quals, signatures):
+        # Split spilled reads into batches of whole buckets, reads without a signature are buckets of their own
+        order = np.argsort(signatures, kind='stable')
+        sorted_sigs = signatures[order]
+        bucket_starts = np.append(np.flatnonzero(np.concatenate([[True], (sorted_sigs[1:] != sorted_sigs[:-1]) |
+                                                                 (sorted_sigs[1:] < 0)])), len(order))
+        cuts = np.unique(bucket_starts[np.searchsorted(bucket_starts, np.arange(self.batch_size, len(order),
+                                                                                self.batch_size))])
+        batches = []
+        for rows in np.split(order, cuts):
+            if len(rows):
+                rows = np.sort(rows)
+                batches.append((reads[rows], lengths[rows], None if quals is None else quals[rows], signatures[rows]))
+        return batches
+
+
+def cluster_reads(reads, lengths, signatures, code_word_len, quals=None, max_dist=4):
+    """
+    Group reads by signature and build one consensus read per group.
+
+    Reads sharing a signature (see read_signatures) form a cluster. Its reads of the code word length vote per
+    position for a first consensus. Its reads one symbol longer or shorter (a single indel) are aligned onto
+    it by dropping their extra symbol, or skipping the missing one, where that leaves the fewest
+    substitutions (from prefix and suffix sums of their mismatches), and then vote too, except at the skipped
+    position. The consensus takes the majority symbol and the mean quality of its voters at each position; a
+    cluster with a tie at some position is flagged (its consensus then takes the smallest tied symbol there).
+    Reads more than max_dist substitutions away from the first consensus (mostly reads of another oligo sharing
+    the signature), reads with several indels or without signature, and the reads of clusters without a read
+    of the code word length are left in clusters of their own.
+
+    Parameters:
+    - reads: Right padded uint8 array of reads (one per row, at least code_word_len + 1 wide).
+    - lengths: Read lengths.
+    - signatures: Signature of every read (negative for none).
+    - code_word_len: Length of the code word.
+    - quals: Phred base qualities of the reads (padded 2-D array like reads), None without qualities.
+    - max_dist: Maximum number of substitutions between a read and the first consensus of its cluster, reads
+      further away are moved to clusters of their own.
+
+    Returns:
+    - Right padded uint8 array of consensus reads (one per cluster), and their lengths.
+    - Consensus qualities (uint8, same shape as the consensus reads; None without quals).
+    - Cluster of every read.
+    - Number of reads of every cluster.
+    - Boolean mask of the clusters with a tie in their per-position vote.
+    """
+    reads = np.asarray(reads, dtype=np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    read_num = len(lengths)
+    full = lengths == code_word_len
+    alone = (np.asarray(signatures) < 0) | (np.abs(lengths - code_word_len) > 1)
+    signatures = np.where(alone, -1 - np.arange(read_num), signatures)
+
+    # First consensus of every cluster of several reads, from its reads of the code word length
+    cluster, sizes = np.unique(signatures, return_inverse=True, return_counts=True)[1:]
+    members = np.flatnonzero(sizes[cluster.reshape(-1)] > 1)
+    member_cluster, member_sizes = np.unique(signatures[members], return_inverse=True, return_counts=True)[1:]
+    member_cluster = member_cluster.reshape(-1)
+    aligned = reads[members, :code_word_len]
+    voting = np.ones(aligned.shape, dtype=bool)
+    member_full = full[members]
+    has_full = np.zeros(len(member_sizes), dtype=bool)
+    has_full[member_cluster[member_full]] = True
+    first_consensus = _vote(aligned[member_full], voting[member_full], member_cluster[member_full],
+                            len(member_sizes))[0]
+    dist = np.count_nonzero(aligned != first_consensus[member_cluster], axis=1)
+
+    # Reads with one indel are aligned onto it
+    index = np.broadcast_to(np.arange(code_word_len), aligned.shape).copy()
+    indel = np.flatnonzero(~member_full & has_full[member_cluster])
+    if len(indel):
+        index[indel], voting[indel], dist[indel] = _align_indels(reads[members[indel]], lengths[members[indel]],
+                                                                 first_consensus[member_cluster[indel]])
+        aligned[indel] = np.take_along_axis(reads[members[indel]], index[indel], axis=1)
+
+    # Reads far from the first consensus and lone reads with an indel stay alone
+    far = (dist > max_dist) | (~member_full & ~has_full[member_cluster])
+    signatures[members[far]] = -1 - members[far]
+    first_read, cluster, sizes = np.unique(signatures, return_index=True, return_inverse=True,
+                                           return_counts=True)[1:]
+    cluster = cluster.reshape(-1)
+
+    # Single reads are their own consensus, clusters of several reads vote per position
+    consensus = reads[first_read].copy()
+    cons_lengths = lengths[first_read]
+    cons_quals = None if quals is None else np.asarray(quals, dtype=np.uint8)[first_read].copy()
+    tied = np.zeros(len(sizes), dtype=bool)
+    near = np.flatnonzero(sizes[cluster[members]] > 1)
+    if len(near):
+        voted, near_cluster = np.unique(cluster[members[near]], return_inverse=True)
+        near_quals = None
+        if quals is not None:
+            near_quals = np.take_along_axis(np.asarray(quals, dtype=np.uint8)[members[near]], index[near], axis=1)
+        consensus[voted] = 0
+        consensus[voted, :code_word_len], tied[voted], voted_quals = _vote(aligned[near], voting[near],
+                                                                           near_cluster.reshape(-1), len(voted),
+                                                                           near_quals)
+        cons_lengths[voted] = code_word_len
+        if quals is not None:
+            cons_quals[voted] = 0
+            cons_quals[voted, :code_word_len] = voted_quals
+    return consensus, cons_lengths, cons_quals, cluster, sizes, tied
+
+
+def _vote(aligned, voting, cluster, cluster_num, quals=None):
+    # Per-position majority of the voting symbols of every cluster (the smallest symbol on a tie), whether it
+    # has a tie, and the mean quality of its voters per position (None without quals), VOTE_BLOCK clusters
+    # at a time
+    width = aligned.shape[1]
+    consensus = np.zeros((cluster_num, width), dtype=np.uint8)
+    tied = np.zeros(cluster_num, dtype=bool)
+    cons_quals = None if quals is None else np.zeros((cluster_num, width), dtype=np.uint8)
+    order = np.argsort(cluster, kind='stable')
+    bounds = np.searchsorted(cluster[order], np.arange(0, cluster_num + VOTE_BLOCK, VOTE_BLOCK))
+    for block, start in enumerate(range(0, cluster_num, VOTE_BLOCK)):
+        rows = order[bounds[block]:bounds[block + 1]]
+        block_num = min(VOTE_BLOCK, cluster_num - start)
+        cells = ((cluster[rows] - start)[:, None] * width + np.arange(width))[voting[rows]]
+        votes = np.bincount(4 * cells + aligned[rows][voting[rows]], minlength=4 * width * block_num)
+        votes = votes.reshape(block_num, width, 4)
+        consensus[start:start + block_num] = votes.argmax(axis=2)
+        top_two = np.sort(votes, axis=2)[:, :, -2:]
+        tied[start:start + block_num] = (top_two[:, :, 0] == top_two[:, :, 1]).any(axis=1)
+        if quals is not None:
+            qual_sums = np.bincount(cells, quals[rows][voting[rows]], width * block_num).reshape(block_num, width)
+            cons_quals[start:start + block_num] = qual_sums // np.maximum(votes.sum(axis=2), 1)
+    return consensus, tied, cons_quals
+
+
+def _align_indels(reads, lengths, refs):
+    # Align reads one symbol longer or shorter than their reference oligo, dropping the inserted symbol or
+    # skipping the deleted one where that leaves the fewest substitutions; returns the read position of every
+    # reference position, the mask of the positions that vote (all but a skipped one) and the substitutions
+    code_word_len = refs.shape[1]
+    positions = np.arange(code_word_len)
+    insertion = (lengths > code_word_len)[:, None]
+    # Mismatches before an indel at position j, and after it (the read shifted by one)
+    before = np.zeros((len(lengths), code_word_len + 1), dtype=np.int64)
+    before[:, 1:] = np.cumsum(reads[:, :code_word_len] != refs, axis=1)
+    shifted = np.where(insertion, reads[:, 1:code_word_len + 1], np.roll(reads[:, :code_word_len], 1, axis=1))
+    after = np.zeros((len(lengths), code_word_len + 1), dtype=np.int64)
+    after[:, :code_word_len] = np.cumsum((shifted != refs)[:, ::-1], axis=1)[:, ::-1]
+    # A read deletion at position j leaves the reference symbols after j to the shifted read
+    after = np.where(insertion, after, np.concatenate([after[:, 1:], np.full((len(lengths), 1), code_word_len)],
+                                                      axis=1))
+    cost = before + after
+    indel_pos = cost.argmin(axis=1)[:, None]
+    index = np.where(insertion, positions + (positions >= indel_pos), positions - (positions > indel_pos))
+    voting = insertion | (positions != indel_pos)
+    return index, voting, cost.min(axis=1)
+
+
+def Palette_dec_clustered(reads, lengths, signatures, length_ary, enc_binary_len_dic, code_word_len, vt_k,
+                          toatl_file_num, key, quals=None, max_dist=4):
+    """
+    Palette_dec_records on one consensus per cluster of reads (see cluster_reads) instead of every read.
+
+    The record of a consensus stands for all the reads of its cluster: it is repeated once per read, or with
+    quals its vote weights are multiplied by the cluster size. The reads of clusters of several reads whose
+    consensus fails VT decoding, or decodes to another file ID or address than the symbols at its own
+    information positions, are decoded one by one, as are the reads of clusters with a tie in their
+    per-position vote. A single read is its own consensus, so its record is kept as Palette_dec_records gives
+    it (VT may correct a substitution in its ID or address symbols). Records follow the order of the first
+    read of their cluster, so majority ties still go to the record of an early read of the batch.
+
+    Parameters:
+    - reads: Right padded uint8 array of reads (one per row, at least code_word_len + 1 wide).
+    - lengths: Read lengths.
+    - signatures: Signature of every read (see read_signatures).
+    - length_ary: Radix.
+    - enc_binary_len_dic: Dictionary containing the length of the original binary sequence for each file.
+    - code_word_len: Length of the code word.
+    - vt_k: VT information bits.
+    - toatl_file_num: Total number of files.
+    - key: Key word as a uint8 array of quaternary symbols.
+    - quals: Phred base qualities of the reads (padded 2-D array like reads), for soft voting.
+    - max_dist: Maximum distance between a read and the consensus of its cluster (see cluster_reads).
+
+    Returns:
+    - The same as Palette_dec_records, with the number of failed VT decodings counting consensus reads.
+    """
+    reads = np.asarray(reads, dtype=np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    consensus, cons_lengths, cons_quals, cluster, sizes, tied = cluster_reads(reads, lengths, signatures,
+                                                                              code_word_len, quals, max_dist)
+    id_nums, ab_words, error_seq_num, ab_weights, cons_decoded = Palette_dec_records(
+        consensus, code_word_len, vt_k, toatl_file_num, key, cons_lengths, cons_quals)
+
+    # A consensus of several reads must have a strict majority everywhere and decode to the ID and address at
+    # its own information positions, a miscorrection would outvote the reads
+    rec_cluster = np.flatnonzero(cons_decoded)
+    match = sizes[rec_cluster] == 1
+    id_len = file_id_len(toatl_file_num)
+    word_len = min(vt_k, len(key))
+    systematic_index = vt_systematic_index(code_word_len)[:word_len]
+    raw_ids, raw_words = split_words(consensus[rec_cluster][:, systematic_index], key, word_len - id_len // 2,
+                                     id_len)
+    for id_num in np.unique(id_nums[~match]):
+        rows = np.flatnonzero(~match & (id_nums == id_num))
+        if int(id_num) in enc_binary_len_dic:
+            address_index = _address_index(enc_binary_len_dic[int(id_num)], length_ary)
+            match[rows] = (raw_ids[rows] == id_num) & np.all(raw_words[rows][:, address_index] ==
+                                                              ab_words[rows][:, address_index], axis=1)
+    match &= ~tied[rec_cluster]
+    id_nums, ab_words, rec_cluster = id_nums[match], ab_words[match], rec_cluster[match]
+    if ab_weights is not None:
+        ab_weights = ab_weights[match]
+    cons_decoded[:] = False
+    cons_decoded[rec_cluster] = True
+    rec_sizes = sizes[rec_cluster]
+    rec_reads = np.unique(cluster, return_index=True)[1][rec_cluster]  # First read of the cluster of every record
+    if ab_weights is None:
+        id_nums, ab_words = np.repeat(id_nums, rec_sizes), np.repeat(ab_words, rec_sizes, axis=0)
+        rec_reads = np.repeat(rec_reads, rec_sizes)
+    else:
+        ab_weights = ab_weights * rec_sizes[:, None].astype(np.float32)
+
+    # Fall back to the reads of the clusters whose consensus failed
+    decoded = cons_decoded[cluster]
+    retry = np.flatnonzero(~decoded & (sizes[cluster] > 1))
+    if len(retry):
+        retry_quals = None if quals is None else np.asarray(quals)[retry]
+        retry_ids, retry_words, retry_error_num, retry_weights, retry_decoded = Palette_dec_records(
+            reads[retry], code_word_len, vt_k, toatl_file_num, key, lengths[retry], retry_quals)
+        decoded[retry] = retry_decoded
+        error_seq_num += retry_error_num
+        id_nums, ab_words = np.concatenate([id_nums, retry_ids]), np.concatenate([ab_words, retry_words])
+        rec_reads = np.concatenate([rec_reads, retry[retry_decoded]])
+        if ab_weights is not None:
+            ab_weights = np.concatenate([ab_weights, retry_weights])
+
+    # Records in read order
+    order = np.argsort(rec_reads, kind='stable')
+    if ab_weights is not None:
+        ab_weights = ab_weights[order]
+    return id_nums[order], ab_words[order], error_seq_num, ab_weights, decoded
+
+
+def _address_index(enc_binary_len, length_ary):
+    # Positions of the address symbols in the payload/address words of a file (as in VoteAccumulator)
+    return address_layout(length_ary, label_len(enc_binary_len / length_ary))[1][length_ary // 2:]
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+from DNA_Ladder_code import read_file
+from Palette_enc_dec import pack_bitmap, unpack_bitmap
+
+MANIFEST_VERSION = 1
+
+
+def file_checksum(byte_seq):
+    """
+    SHA-256 checksum of a byte sequence, as a hex string.
+    """
+    return hashlib.sha256(bytes(byte_seq)).hexdigest()
+
+
+def write_manifest(manifest_path, str_len, key_word, enc_list, file_path_list, source_checksum_list=None,
+                   references=None):
+    """
+    Write the JSON manifest describing an encoded dataset, so it can be decoded without hardcoded parameters.
+
+    Parameters:
+    - manifest_path: Manifest file name.
+    - str_len: Length of the a sequence (in quaternary symbols).
+    - key_word: Seed to determine the random key string.
+    - enc_list: Per-file encoding results of parallel_encode, in file ID order.
+    - file_path_list: Encoded file names, in file ID order (their checksums are stored).
+    - source_checksum_list: Checksums of the original files restored after decoding (optional).
+    - references: Reference slice of every file in the differential encoding, -1 for none (returned by
+      differential_enc; default: no differential encoding).
+
+    Returns:
+    - Manifest dictionary.
+    """
+    if references is None:
+        references = [-1] * len(enc_list)
+    files = []
+    for id_num, enc in enumerate(enc_list):
+        codewords, minus_num, binary_len, code_word_len, vt_k, file_len = enc[:6]
+        file_info = {'id': id_num, 'name': os.path.basename(file_path_list[id_num]),
+                     'file_len': int(file_len), 'enc_binary_len': int(binary_len),
+                     'code_word_len': int(code_word_len), 'vt_k': int(vt_k), 'oligo_num': len(codewords),
+                     'minus_num': int(minus_num), 'checksum': file_checksum(read_file(file_path_list[id_num]))}
+        if len(enc) > 6:
+            # Addresses whose segment is all zero have no oligo
+            file_info['segment_num'] = len(enc[6])
+            file_info['segment_bitmap'] = pack_bitmap(enc[6])
+        if source_checksum_list is not None:
+            file_info['source_checksum'] = source_checksum_list[id_num]
+        files.append(file_info)
+
+    manifest = {'version': MANIFEST_VERSION, 'str_len': int(str_len), 'length_ary': int(str_len) * 2,
+                'key': key_word, 'file_num': len(files), 'checksum': 'sha256',
+                'code_word_len': files[0]['code_word_len'] if files else 0,
+                'vt_k': files[0]['vt_k'] if files else 0,
+                'oligo_num': sum(file_info['oligo_num'] for file_info in files),
+                'references': [int(i) for i in references], 'files': files}
+    manifest['keyframes'] = [i for i, reference in enumerate(manifest['references']) if reference < 0]
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def load_manifest(manifest_path):
+    """
+    Load a manifest written by write_manifest.
+
+    Parameters:
+    - manifest_path: Manifest file name.
+
+    Returns:
+    - Manifest dictionary.
+    - Dictionary containing the length of the RS encoded binary sequence of each file.
+    - Dictionary containing the original length of each file.
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        print('Unsupported manifest version:', manifest.get('version'))
+        raise RuntimeError
+    enc_binary_len_dic = {file_info['id']: file_info['enc_binary_len'] for file_info in manifest['files']}
+    file_len_dic = {file_info['id']: file_info['file_len'] for file_info in manifest['files']}
+    return manifest, enc_binary_len_dic, file_len_dic
+
+
+def segment_masks(manifest):
+    """
+    Masks of the addresses that have oligos, from the non-zero segment bitmaps of the manifest.
+
+    Parameters:
+    - manifest: Manifest dictionary.
+
+    Returns:
+    - Dictionary with, for each file with a bitmap, a boolean array of its non-zero segments by address.
+    """
+    mask_dic = {}
+    for file_info in manifest['files']:
+        if 'segment_bitmap' in file_info:
+            mask_dic[file_info['id']] = unpack_bitmap(file_info['segment_bitmap'], file_info['segment_num'])
+    return mask_dic
+
+
+def verify_files(manifest, byte_dic, key='checksum'):
+    """
+    Check decoded files against the checksums of the manifest.
+
+    Parameters:
+    - manifest: Manifest dictionary.
+    - byte_dic: Dictionary containing the decoded bytes of each file.
+    - key: Checksum field to compare with ('checksum' for encoded files, 'source_checksum' for restored files).
+
+    Returns:
+    - Dictionary with, for each file of the manifest, whether its decoded bytes match the checksum.
+    """
+    return {file_info['id']: file_info['id'] in byte_dic and
+            file_checksum(byte_dic[file_info['id']]) == file_info[key]
+            for file_info in manifest['files']}
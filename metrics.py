@@ -0,0 +1,231 @@
+import json
+import time
+import numpy as np
+
+# Default histogram buckets (upper bounds, an implicit +Inf bucket follows)
+COVERAGE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+MARGIN_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+RS_CORRECTION_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+
+
+class Registry:
+    def __init__(self):
+        """
+        Counters, timers and histograms of one process, keyed by metric name and labels.
+        """
+        self.counters = {}
+        self.timers = {}  # [number of calls, total seconds]
+        self.histograms = {}  # [bucket upper bounds, bucket counts (last one is +Inf), sum, count]
+
+    def inc(self, name, value=1, labels=None):
+        # Add value to a counter
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_time(self, name, seconds, labels=None):
+        # Add one call of the given duration to a timer
+        timer = self.timers.setdefault(_key(name, labels), [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+
+    def observe(self, name, values, buckets, labels=None):
+        # Add an array of values to a histogram
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        histogram = self.histograms.setdefault(_key(name, labels),
+                                               [tuple(buckets), np.zeros(len(buckets) + 1, dtype=np.int64), 0.0, 0])
+        # Bucket i counts the values in (buckets[i - 1], buckets[i]]
+        histogram[1] += np.bincount(np.searchsorted(histogram[0], values), minlength=len(buckets) + 1)
+        histogram[2] += float(values.sum())
+        histogram[3] += len(values)
+
+    def merge(self, snapshot):
+        """
+        Add the metrics of a snapshot (see snapshot), e.g. recorded in a worker process.
+        """
+        for item in snapshot['counters']:
+            self.inc(item['name'], item['value'], item['labels'])
+        for item in snapshot['timers']:
+            timer = self.timers.setdefault(_key(item['name'], item['labels']), [0, 0.0])
+            timer[0] += item['count']
+            timer[1] += item['seconds']
+        for item in snapshot['histograms']:
+            histogram = self.histograms.setdefault(_key(item['name'], item['labels']),
+                                                   [tuple(item['buckets']),
+                                                    np.zeros(len(item['buckets']) + 1, dtype=np.int64), 0.0, 0])
+            histogram[1] += np.asarray(item['counts'], dtype=np.int64)
+            histogram[2] += item['sum']
+            histogram[3] += item['count']
+
+    def snapshot(self):
+        """
+        Metrics as a JSON serializable dictionary.
+        """
+        return {'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'timers': [{'name': name, 'labels': dict(labels), 'count': count, 'seconds': seconds}
+                           for (name, labels), (count, seconds) in sorted(self.timers.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'buckets': list(buckets),
+                                'counts': counts.tolist(), 'sum': total, 'count': count}
+                               for (name, labels), (buckets, counts, total, count) in sorted(self.histograms.items())]}
+
+
+class _Timer:
+    # Context manager adding the elapsed time to a timer of the current registry, if any
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        if _current is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if _current is not None:
+            _current.add_time(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+class _Capture:
+    # Context manager recording into a fresh registry, restoring the previous one on exit
+    def __enter__(self):
+        global _current
+        self.previous = _current
+        _current = Registry()
+        return _current
+
+    def __exit__(self, *exc):
+        global _current
+        _current = self.previous
+        return False
+
+
+_current = None  # Registry recording the metrics, None when disabled
+
+
+def enable(registry=None):
+    """
+    Start recording metrics into registry (default: a new Registry), which is returned.
+    """
+    global _current
+    _current = Registry() if registry is None else registry
+    return _current
+
+
+def disable():
+    """
+    Stop recording metrics, returns the registry that was recording (None if disabled).
+    """
+    global _current
+    registry, _current = _current, None
+    return registry
+
+
+def enabled():
+    """
+    Whether metrics are being recorded; instrumented code checks it before computing costly values.
+    """
+    return _current is not None
+
+
+def registry():
+    """
+    Registry recording the metrics, None when disabled.
+    """
+    return _current
+
+
+def capture():
+    """
+    Context manager recording the metrics of its block into a new Registry, e.g. in a worker process whose
+    snapshot is merged into the registry of the parent.
+    """
+    return _Capture()
+
+
+def inc(name, value=1, labels=None):
+    """
+    Add value to a counter (no-op when disabled).
+    """
+    if _current is not None:
+        _current.inc(name, value, labels)
+
+
+def observe(name, values, buckets, labels=None):
+    """
+    Add an array of values to a histogram with the given bucket upper bounds (no-op when disabled).
+    """
+    if _current is not None:
+        _current.observe(name, values, buckets, labels)
+
+
+def timer(name, labels=None):
+    """
+    Context manager timing its block (no timing when disabled).
+    """
+    return _Timer(name, labels)
+
+
+def merge(snapshot):
+    """
+    Merge a snapshot into the recording registry (no-op when disabled or when snapshot is None).
+    """
+    if _current is not None and snapshot is not None:
+        _current.merge(snapshot)
+
+
+def write_json(file_path, registry=None):
+    """
+    Write the snapshot of a registry (default: the recording one) as JSON.
+    """
+    registry = _current if registry is None else registry
+    with open(file_path, 'w') as f:
+        json.dump(registry.snapshot(), f, indent=1)
+
+
+def prometheus_text(registry=None):
+    """
+    Metrics of a registry (default: the recording one) in the Prometheus text exposition format.
+
+    Counters are exported as <name>_total, timers as <name>_seconds_total and <name>_calls_total, and
+    histograms as cumulative <name>_bucket series with <name>_sum and <name>_count.
+    """
+    snapshot = (_current if registry is None else registry).snapshot()
+    lines = []
+    for item in snapshot['counters']:
+        _type_line(lines, item['name'] + '_total', 'counter')
+        lines.append(_series(item['name'] + '_total', item['labels'], item['value']))
+    for suffix in ('_seconds_total', '_calls_total'):
+        for item in snapshot['timers']:
+            _type_line(lines, item['name'] + suffix, 'counter')
+            value = item['seconds'] if suffix == '_seconds_total' else item['count']
+            lines.append(_series(item['name'] + suffix, item['labels'], value))
+    for item in snapshot['histograms']:
+        _type_line(lines, item['name'], 'histogram')
+        cumulative = np.cumsum(item['counts'])
+        for bound, count in zip(list(item['buckets']) + ['+Inf'], cumulative):
+            lines.append(_series(item['name'] + '_bucket', dict(item['labels'], le=str(bound)), int(count)))
+        lines.append(_series(item['name'] + '_sum', item['labels'], item['sum']))
+        lines.append(_series(item['name'] + '_count', item['labels'], item['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def _key(name, labels):
+    # Registry key of a metric: name and sorted label items
+    return name, tuple(sorted((str(k), str(v)) for k, v in labels.items())) if labels else ()
+
+
+def _type_line(lines, name, metric_type):
+    # TYPE comment before the first sample of a metric family
+    line = '# TYPE {} {}'.format(name, metric_type)
+    if line not in lines:
+        lines.append(line)
+
+
+def _series(name, labels, value):
+    # One Prometheus sample line
+    if labels:
+        name += '{' + ','.join('{}="{}"'.format(k, v) for k, v in labels.items()) + '}'
+    return '{} {}'.format(name, value)
@@ -0,0 +1,170 @@
+import json
+import numpy as np
+
+# Container layout: CONTAINER_MAGIC, uint64 header length, JSON header, zero padding to a multiple of
+# DATA_ALIGN bytes, then one row of row_bytes bytes per oligo (4 nucleotides per byte, first nucleotide
+# in the high bits), the oligos of file 0 first.
+CONTAINER_MAGIC = b'DNAPALC1'
+DATA_ALIGN = 64
+BASE_BYTES = np.frombuffer(b'ATGC', dtype=np.uint8)  # 0: A, 1: T, 2: G, 3: C
+
+
+def pack_oligos(codewords):
+    """
+    Pack quaternary oligos into 2 bits per nucleotide.
+
+    Parameters:
+    - codewords: Array of oligos (one per row) of quaternary symbols.
+
+    Returns:
+    - uint8 array with ceil(oligo length / 4) bytes per oligo.
+    """
+    codewords = np.asarray(codewords, dtype=np.uint8)
+    oligo_num, oligo_len = codewords.shape
+    row_bytes = -(-oligo_len // 4)
+    padded = np.zeros((oligo_num, row_bytes * 4), dtype=np.uint8)
+    padded[:, :oligo_len] = codewords
+    padded = padded.reshape(oligo_num, row_bytes, 4)
+    return (padded[:, :, 0] << 6) | (padded[:, :, 1] << 4) | (padded[:, :, 2] << 2) | padded[:, :, 3]
+
+
+def unpack_oligos(packed, oligo_len):
+    """
+    Unpack oligos packed by pack_oligos.
+
+    Parameters:
+    - packed: uint8 array with the packed oligos (one per row).
+    - oligo_len: Number of nucleotides per oligo.
+
+    Returns:
+    - uint8 array of quaternary symbols (one oligo per row).
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+    symbols = (packed[:, :, None] >> shifts) & 3
+    return symbols.reshape(len(packed), -1)[:, :oligo_len]
+
+
+def write_container(file_path, codeword_list, length_ary, key_word, code_word_len_list, vt_k_list,
+                    enc_binary_len_list, file_len_list):
+    """
+    Write the oligos of all files into a packed binary container with a header of the code parameters.
+
+    Parameters:
+    - file_path: Container file name.
+    - codeword_list: List with the codeword array of each file, in file ID order.
+    - length_ary: Radix.
+    - key_word: Seed to determine the random key string.
+    - code_word_len_list: Code word length of each file.
+    - vt_k_list: Number of VT information bits of each file.
+    - enc_binary_len_list: Length of the RS encoded binary string of each file.
+    - file_len_list: Original length of each file.
+
+    Returns:
+    - Header dictionary written to the container.
+    """
+    oligo_len = max(int(n) for n in code_word_len_list)
+    files = []
+    for i, codewords in enumerate(codeword_list):
+        files.append({'oligo_num': len(codewords), 'code_word_len': int(code_word_len_list[i]),
+                      'vt_k': int(vt_k_list[i]), 'enc_binary_len': int(enc_binary_len_list[i]),
+                      'file_len': int(file_len_list[i])})
+    header = {'length_ary': int(length_ary), 'key': key_word, 'file_num': len(codeword_list),
+              'oligo_len': oligo_len, 'row_bytes': -(-oligo_len // 4), 'files': files}
+
+    header_bytes = json.dumps(header).encode()
+    data_offset = len(CONTAINER_MAGIC) + 8 + len(header_bytes)
+    padding = -data_offset % DATA_ALIGN
+    with open(file_path, 'wb') as f:
+        f.write(CONTAINER_MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        f.write(bytes(padding))
+        for codewords in codeword_list:
+            codewords = np.asarray(codewords, dtype=np.uint8)
+            rows = np.zeros((len(codewords), oligo_len), dtype=np.uint8)
+            rows[:, :codewords.shape[-1]] = codewords
+            pack_oligos(rows).tofile(f)
+    return header
+
+
+def read_container(file_path):
+    """
+    Open a container written by write_container without loading the oligos.
+
+    Parameters:
+    - file_path: Container file name.
+
+    Returns:
+    - Header dictionary.
+    - Read-only memory map of the packed oligos (one per row).
+    """
+    with open(file_path, 'rb') as f:
+        if f.read(len(CONTAINER_MAGIC)) != CONTAINER_MAGIC:
+            print('Not an oligo container:', file_path)
+            raise RuntimeError
+        header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_len).decode())
+    data_offset = len(CONTAINER_MAGIC) + 8 + header_len
+    data_offset += -data_offset % DATA_ALIGN
+    oligo_num = sum(file_info['oligo_num'] for file_info in header['files'])
+    if oligo_num == 0:
+        return header, np.zeros((0, header['row_bytes']), dtype=np.uint8)
+    packed = np.memmap(file_path, dtype=np.uint8, mode='r', offset=data_offset,
+                       shape=(oligo_num, header['row_bytes']))
+    return header, packed
+
+
+def load_oligos(file_path, id_num=None):
+    """
+    Load the oligos of one file (or of all files) from a container.
+
+    Parameters:
+    - file_path: Container file name.
+    - id_num: File ID, None loads all files.
+
+    Returns:
+    - uint8 array of quaternary symbols (one oligo per row).
+    """
+    header, packed = read_container(file_path)
+    if id_num is None:
+        return unpack_oligos(packed, header['oligo_len'])
+    oligo_nums = [file_info['oligo_num'] for file_info in header['files']]
+    start = sum(oligo_nums[:id_num])
+    file_info = header['files'][id_num]
+    return unpack_oligos(packed[start:start + oligo_nums[id_num]], file_info['code_word_len'])
+
+
+def export_oligos(container_path, out_path, primers=('', ''), fasta=False, chunk_size=100000):
+    """
+    Export the oligos of a container as text for synthesis: one oligo per line, or FASTA records
+    named <file ID>_<oligo number>, with the primers added to both ends.
+
+    Parameters:
+    - container_path: Container file name.
+    - out_path: Output text file name.
+    - primers: Forward primer added before and reverse primer added after every oligo.
+    - fasta: Write FASTA records instead of plain lines.
+    - chunk_size: Number of oligos converted at a time.
+    """
+    header, packed = read_container(container_path)
+    left = np.frombuffer(primers[0].encode(), dtype=np.uint8)
+    right = np.frombuffer(primers[1].encode(), dtype=np.uint8)
+    with open(out_path, 'wb') as f:
+        start = 0
+        for id_num, file_info in enumerate(header['files']):
+            code_word_len = file_info['code_word_len']
+            for chunk_start in range(0, file_info['oligo_num'], chunk_size):
+                chunk_end = min(chunk_start + chunk_size, file_info['oligo_num'])
+                bases = BASE_BYTES[unpack_oligos(packed[start + chunk_start:start + chunk_end], code_word_len)]
+                lines = np.empty((len(bases), len(left) + code_word_len + len(right) + 1), dtype=np.uint8)
+                lines[:, :len(left)] = left
+                lines[:, len(left):len(left) + code_word_len] = bases
+                lines[:, len(left) + code_word_len:-1] = right
+                lines[:, -1] = ord('\n')
+                if fasta:
+                    f.write(b''.join(b'>%d_%d\n' % (id_num, chunk_start + i) + line.tobytes()
+                                     for i, line in enumerate(lines)))
+                else:
+                    f.write(lines.tobytes())
+            start += file_info['oligo_num']
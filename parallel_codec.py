@@ -0,0 +1,314 @@
+import os
+import numpy as np
+import metrics
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from DNA_Ladder_code import read_file, rs_encode_array
+from vt import pad_rows
+from salvage import salvage_records, seed_records
+from cluster import Palette_dec_clustered, ReadBuckets
+from Palette_enc_dec import (Palette_enc_segments, Palette_dec_records, VoteAccumulator, SoftVoteAccumulator,
+                             coverage_report, get_key, segment_mask, segment_rows)
+
+
+def _rs_encode_file(file_path, a_len):
+    # Worker: read one file and RS encode it
+    return rs_encode_array(read_file(file_path), a_len)
+
+
+def parallel_encode(file_path_list, str_len, key_word, workers=None, shard_seg_num=4096):
+    """
+    RS and Palette encode a list of files with a process pool.
+
+    Files are RS encoded in parallel. The non-zero segments of each file are found with one reduction
+    over its bytes (segment_mask), and only those are split into shards of shard_seg_num segments which
+    are Palette encoded in parallel, so the work depends on the non-zero content. Results are collected
+    in file and shard order, so the codewords are the same as encoding the files one after another.
+
+    Parameters:
+    - file_path_list: List of file names, in file ID order.
+    - str_len: Length of the a sequence (in quaternary symbols).
+    - key_word: Seed to determine the random key string.
+    - workers: Number of worker processes (default: number of CPUs, 1 runs in this process).
+    - shard_seg_num: Number of segments per Palette encoding task.
+
+    Returns:
+    - List with, for each file, the tuple (codeword array, minus sequence number, length of the RS
+      encoded binary string, code word length, number of VT information bits, original file length,
+      boolean mask of the non-zero segments by address).
+    """
+    file_num = len(file_path_list)
+    length_ary = str_len * 2
+    a_len = str_len // 4
+
+    executor, submit = _start_pool(workers)
+    try:
+        rs_futures = [submit(_rs_encode_file, file_path, a_len) for file_path in file_path_list]
+
+        shard_futures = []
+        file_info_list = []
+        for id_num, rs_future in enumerate(rs_futures):
+            rs_enc, file_txt_len = rs_future.result()
+            binary_len = 8 * len(rs_enc)
+            mask = segment_mask(rs_enc, length_ary)
+            seg_ids = np.flatnonzero(mask)
+            file_info_list.append((len(mask) - len(seg_ids), binary_len, file_txt_len, mask))
+            shards = []
+            for shard_start in range(0, max(len(seg_ids), 1), shard_seg_num):
+                shard_ids = seg_ids[shard_start:shard_start + shard_seg_num]
+                shards.append(submit(Palette_enc_segments, segment_rows(rs_enc, shard_ids, length_ary), shard_ids,
+                                     length_ary, id_num, file_num, key_word, binary_len))
+            shard_futures.append(shards)
+
+        enc_list = []
+        for id_num in range(file_num):
+            shard_results = [shard.result() for shard in shard_futures[id_num]]
+            codeword_array = np.concatenate([result[0] for result in shard_results])
+            code_word_len, vt_k = shard_results[0][1:]
+            minus_num, binary_len, file_txt_len, mask = file_info_list[id_num]
+            enc_list.append((codeword_array, minus_num, binary_len, code_word_len, vt_k, file_txt_len, mask))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return enc_list
+
+
+def _decode_chunk(read_chunk, lengths, code_word_len, vt_k, toatl_file_num, key, quals=None, cluster_info=None,
+                  with_metrics=False):
+    # Map worker: VT decode a chunk of padded reads into (ID, payload/address word, vote weight) records,
+    # one consensus per cluster of reads when cluster_info (signatures, length_ary, enc_binary_len_dic) is given, and
+    # the snapshot of the metrics recorded meanwhile when with_metrics is set (None otherwise)
+    if not with_metrics:
+        return _decode_records(read_chunk, lengths, code_word_len, vt_k, toatl_file_num, key, quals,
+                               cluster_info), None
+    with metrics.capture() as registry:
+        records = _decode_records(read_chunk, lengths, code_word_len, vt_k, toatl_file_num, key, quals, cluster_info)
+    return records, registry.snapshot()
+
+
+def _decode_records(read_chunk, lengths, code_word_len, vt_k, toatl_file_num, key, quals, cluster_info):
+    # Records of a chunk, read by read or one consensus per cluster
+    if cluster_info is not None:
+        return Palette_dec_clustered(read_chunk, lengths, *cluster_info, code_word_len, vt_k, toatl_file_num, key,
+                                     quals)
+    return Palette_dec_records(read_chunk, code_word_len, vt_k, toatl_file_num, key, lengths, quals)
+
+
+def parallel_decode(txt_table, length_ary, enc_binary_len_dic, code_word_len, vt_k, toatl_file_num, key_str,
+                    workers=None, chunk_size=20000):
+    """
+    Map-reduce version of Palette_dec_array, giving the same decoded files.
+
+    Map workers VT decode chunks of chunk_size reads into compact (ID, payload/address) record arrays.
+    The records are folded, chunk by chunk and in read order, into one VoteAccumulator per file, so
+    majority ties are broken as in the serial decoder.
+
+    Parameters:
+    - txt_table: Table where each entry is a sequence of read symbols.
+    - length_ary: Radix.
+    - enc_binary_len_dic: Dictionary containing the length of the original binary sequence for each file.
+    - code_word_len: Length of the code word.
+    - vt_k: VT information bits.
+    - toatl_file_num: Total number of files.
+    - key_str: Key string.
+    - workers: Number of worker processes (default: number of CPUs, 1 runs in this process).
+    - chunk_size: Number of reads per map task.
+
+    Returns:
+    - Dictionary containing the decoded sequence of each file as a uint8 array of quaternary symbols.
+    """
+    read_chunks = (pad_rows(txt_table[start:start + chunk_size], code_word_len + 1)
+                   for start in range(0, len(txt_table), chunk_size))
+    return parallel_decode_stream(read_chunks, length_ary, enc_binary_len_dic, code_word_len, vt_k,
+                                  toatl_file_num, key_str, workers)[0]
+
+
+def parallel_decode_stream(read_chunks, length_ary, enc_binary_len_dic, code_word_len, vt_k, toatl_file_num,
+                           key_str, workers=None, quality=False, stop_margin=None, expected_dic=None,
+                           salvage=False, salvage_chunk_size=20000, cluster=False, cluster_bucket_size=16,
+                           cluster_buffer_size=1000000):
+    """
+    Map-reduce Palette decoding of a stream of read chunks (see read_stream.read_chunks).
+
+    At most two chunks per worker are in flight and decoded records are folded into per-file vote
+    accumulators as they arrive, so memory depends on the chunk size and the number of addresses only.
+
+    With stop_margin set, reading stops as soon as every expected address of every file in
+    enc_binary_len_dic leads by at least stop_margin votes on all its bits (see VoteAccumulator.resolved);
+    the chunks already in flight are still folded in.
+
+    With salvage set, the reads that fail VT decoding are kept and, after the first vote, the addresses
+    without votes are recovered from the consensus of the failed reads guessed for them (see
+    salvage.seed_records); the other failed reads are aligned onto the consensus oligos of their likely
+    address when it has few votes (see salvage.salvage_records). The reads that can be recovered are added to
+    the vote, except for their symbols taken from a consensus (with weight 1 when quality is set).
+
+    With cluster set, the reads are bucketed by minimizer signature across chunks (see cluster.ReadBuckets) and
+    a bucket is decoded once it holds cluster_bucket_size reads, or when more than cluster_buffer_size reads
+    are buffered, or at the end of the stream. One consensus per cluster of reads is VT decoded, voting for all
+    the reads of its cluster (see cluster.Palette_dec_clustered). Records are then folded in bucket order
+    rather than read order, and reads still buffered at an early termination are neither decoded nor counted.
+
+    Parameters:
+    - read_chunks: Iterable of (right padded read array, read lengths) chunks, or of (reads, lengths,
+      Phred qualities) chunks when quality is set.
+    - length_ary: Radix.
+    - enc_binary_len_dic: Dictionary containing the length of the original binary sequence for each file.
+    - code_word_len: Length of the code word.
+    - vt_k: VT information bits.
+    - toatl_file_num: Total number of files.
+    - key_str: Key string.
+    - workers: Number of worker processes (default: number of CPUs, 1 runs in this process).
+    - quality: Weight the votes by base quality (SoftVoteAccumulator) instead of a plain majority.
+    - stop_margin: Vote margin (in reads, or in weight units with quality) for early termination, None reads all.
+    - expected_dic: Dictionary with, for each file, a boolean mask of the addresses that have oligos
+      (default: all addresses of the file).
+    - salvage: Run the second decoding pass on the reads that failed VT decoding.
+    - salvage_chunk_size: Number of failed reads aligned at a time.
+    - cluster: VT decode one consensus per cluster of reads sharing their signature.
+    - cluster_bucket_size: Number of reads of a signature decoded together.
+    - cluster_buffer_size: Maximum number of reads buffered for clustering.
+
+    Returns:
+    - Dictionary containing the decoded sequence of each file as a uint8 array of quaternary symbols.
+    - Number of reads consumed (less than the input on early termination).
+    - Coverage report of every file in enc_binary_len_dic: recovered and missing addresses, excluding those
+      without oligos, and coverage histogram (see Palette_enc_dec.coverage_report).
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    key = get_key(length_ary, key_str, vt_k)
+    key = np.frombuffer(key.encode(), dtype=np.uint8) - ord('0')
+
+    executor, submit = _start_pool(workers)
+    try:
+        # Map: VT decode batches of reads (the chunks, or the buckets spilled by clustering), sent to the
+        # workers as padded uint8 arrays
+        # Reduce: fold the records of each finished batch into the vote accumulators, in batch order
+        accumulator_dic = {}
+        read_num = 0
+        map_futures = deque()
+        if expected_dic is None:
+            expected_dic = {}
+        accumulate_args = (accumulator_dic, enc_binary_len_dic, length_ary, expected_dic)
+        failed_list = []
+        buckets = ReadBuckets(cluster_bucket_size, cluster_buffer_size) if cluster else None
+        for reads, lengths, quals, signatures in _map_batches(read_chunks, quality, buckets):
+            read_num += len(lengths)
+            cluster_info = None if signatures is None else (signatures, length_ary, enc_binary_len_dic)
+            map_futures.append((submit(_decode_chunk, reads, lengths, code_word_len, vt_k, toatl_file_num, key,
+                                       quals, cluster_info, metrics.enabled()), reads, lengths))
+            while len(map_futures) >= 2 * workers:
+                _reduce_chunk(map_futures.popleft(), accumulate_args, failed_list if salvage else None)
+            if stop_margin is not None and _all_resolved(accumulator_dic, enc_binary_len_dic, stop_margin):
+                break
+        while map_futures:
+            _reduce_chunk(map_futures.popleft(), accumulate_args, failed_list if salvage else None)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if salvage and failed_list:
+        failed_reads = np.concatenate([failed[0] for failed in failed_list])
+        failed_lengths = np.concatenate([failed[1] for failed in failed_list])
+        # Addresses without votes first, from the consensus of their failed reads
+        with metrics.timer('salvage'):
+            id_nums, ab_words, ab_weights, seeded = seed_records(failed_reads, failed_lengths, accumulator_dic,
+                                                                 length_ary, code_word_len, vt_k, toatl_file_num,
+                                                                 key_str, chunk_size=salvage_chunk_size)
+        _add_salvaged(accumulator_dic, id_nums, ab_words, ab_weights, quality)
+        salvaged_num = len(id_nums)
+        failed_reads, failed_lengths = failed_reads[~seeded], failed_lengths[~seeded]
+        for start in range(0, len(failed_lengths), salvage_chunk_size):
+            with metrics.timer('salvage'):
+                id_nums, ab_words, ab_weights = salvage_records(failed_reads[start:start + salvage_chunk_size],
+                                                                failed_lengths[start:start + salvage_chunk_size],
+                                                                accumulator_dic, length_ary, enc_binary_len_dic,
+                                                                code_word_len, vt_k, toatl_file_num, key_str)
+            _add_salvaged(accumulator_dic, id_nums, ab_words, ab_weights, quality)
+            salvaged_num += len(id_nums)
+        metrics.inc('salvaged_reads', salvaged_num)
+
+    if metrics.enabled():
+        metrics.inc('palette_reads', read_num)
+        for id_num, accumulator in accumulator_dic.items():
+            labels = {'file': id_num}
+            metrics.observe('address_coverage', accumulator.counts[accumulator.expected], metrics.COVERAGE_BUCKETS,
+                            labels)
+            metrics.observe('vote_margin', accumulator.margin[accumulator.expected], metrics.MARGIN_BUCKETS, labels)
+    dec_dic = {id_num: accumulator.finalize() for id_num, accumulator in accumulator_dic.items()}
+    return dec_dic, read_num, coverage_report(accumulator_dic, enc_binary_len_dic, length_ary, expected_dic)
+
+
+
+def _add_salvaged(accumulator_dic, id_nums, ab_words, ab_weights, quality):
+    # Add salvaged records to the accumulators of their files; symbols filled in by an alignment do not vote
+    for id_num in np.unique(id_nums):
+        file_words, file_weights = ab_words[id_nums == id_num], ab_weights[id_nums == id_num]
+        if quality:
+            accumulator_dic[int(id_num)].add(file_words, file_weights.astype(np.float32))
+        else:
+            accumulator_dic[int(id_num)].add(file_words, file_weights)
+
+
+def _map_batches(read_chunks, quality, buckets):
+    # Batches (reads, lengths, qualities, signatures) of the map tasks: the chunks themselves (without
+    # signatures), or the buckets they spill when buckets is given
+    for chunk in read_chunks:
+        reads, lengths = np.asarray(chunk[0], dtype=np.uint8), np.asarray(chunk[1])
+        quals = chunk[2] if quality else None
+        if buckets is None:
+            yield reads, lengths, quals, None
+        else:
+            yield from buckets.add(reads, lengths, quals)
+    if buckets is not None:
+        yield from buckets.flush()
+
+def _reduce_chunk(map_task, accumulate_args, failed_list):
+    # Fold a finished map task into the accumulators, keeping its failed reads when failed_list is given
+    future, reads, lengths = map_task
+    failed = ~_accumulate_records(future, *accumulate_args)
+    if failed_list is not None and failed.any():
+        failed_list.append((reads[failed], lengths[failed]))
+
+
+def _accumulate_records(future, accumulator_dic, enc_binary_len_dic, length_ary, expected_dic):
+    # Add the records of a finished map task to the vote accumulator of their file, returns the decoded read mask
+    (id_nums, ab_words, error_seq_num, ab_weights, decoded), snapshot = future.result()
+    metrics.merge(snapshot)
+    for id_num in np.unique(id_nums):
+        id_num = int(id_num)
+        if id_num not in accumulator_dic:
+            accumulator_class = VoteAccumulator if ab_weights is None else SoftVoteAccumulator
+            accumulator_dic[id_num] = accumulator_class(enc_binary_len_dic[id_num], length_ary,
+                                                        expected_dic.get(id_num))
+        if ab_weights is None:
+            accumulator_dic[id_num].add(ab_words[id_nums == id_num])
+        else:
+            accumulator_dic[id_num].add(ab_words[id_nums == id_num], ab_weights[id_nums == id_num])
+    return decoded
+
+
+def _all_resolved(accumulator_dic, enc_binary_len_dic, stop_margin):
+    # Whether every file has been seen and all its expected addresses reached the stop margin
+    return all(id_num in accumulator_dic and accumulator_dic[id_num].resolved(stop_margin)
+               for id_num in enc_binary_len_dic)
+
+
+def _start_pool(workers):
+    # Process pool and its submit function, or immediate in-process execution for a single worker
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1:
+        return None, _SerialFuture
+    executor = ProcessPoolExecutor(max_workers=workers)
+    return executor, executor.submit
+
+
+class _SerialFuture:
+    # Runs the task immediately, with the part of the Future interface used above
+    def __init__(self, fn, *args):
+        self._result = fn(*args)
+
+    def result(self):
+        return self._result
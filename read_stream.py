@@ -0,0 +1,104 @@
+import numpy as np
+
+# Lookup table from ASCII bases to quaternary symbols (0: A, 1: T, 2: G, 3: C, N and unknown bases: 0)
+BASE_TABLE = np.zeros(256, dtype=np.uint8)
+for _base, _symbol in zip(b'ATGCatgc', [0, 1, 2, 3, 0, 1, 2, 3]):
+    BASE_TABLE[_base] = _symbol
+
+
+def read_chunks(file_path, width, chunk_size=100000, trim=(0, 0), with_quality=False):
+    """
+    Stream sequencing reads from a FASTQ, FASTA or plain text (one read per line) file in chunks.
+
+    The format is detected from the first character of the file ('@' FASTQ, '>' FASTA, otherwise plain text).
+    Each chunk is parsed into a right padded uint8 array through BASE_TABLE, so memory depends on chunk_size
+    and width only, not on the number of reads in the file.
+
+    Parameters:
+    - file_path: Sequencing file name.
+    - width: Width of the read arrays; longer reads are truncated but keep their true length.
+    - chunk_size: Maximum number of reads per chunk.
+    - trim: Number of bases (primer) removed from the start and the end of every read.
+    - with_quality: Also yield the Phred base qualities (FASTQ only).
+
+    Yields:
+    - uint8 array of reads (chunk x width) and int64 array of read lengths, plus a uint8 array of
+      Phred qualities (chunk x width) when with_quality is set.
+    """
+    seq_list = []
+    qual_list = []
+    for seq, qual in _iter_reads(file_path, with_quality):
+        seq_list.append(seq)
+        qual_list.append(qual)
+        if len(seq_list) == chunk_size:
+            yield _parse_chunk(seq_list, qual_list, width, trim, with_quality)
+            seq_list = []
+            qual_list = []
+    if seq_list:
+        yield _parse_chunk(seq_list, qual_list, width, trim, with_quality)
+
+
+def _iter_reads(file_path, with_quality=False):
+    # Yield the raw sequence and quality string (None without qualities) of every read of the file as bytes
+    with open(file_path, 'rb') as f:
+        first_line = f.readline()
+        if with_quality and not first_line.startswith(b'@'):
+            print('Base qualities are only available in FASTQ files')
+            raise RuntimeError
+        if first_line.startswith(b'@'):
+            # FASTQ: header, sequence, '+', quality; stops at the end of the file or at a blank header line
+            while first_line.strip():
+                seq = f.readline().strip()
+                f.readline()
+                qual = f.readline().strip()
+                yield seq, (qual if with_quality else None)
+                first_line = f.readline()
+        elif first_line.startswith(b'>'):
+            # FASTA: sequences may span several lines
+            seq_parts = []
+            for line in f:
+                if line.startswith(b'>'):
+                    yield b''.join(seq_parts), None
+                    seq_parts = []
+                else:
+                    seq_parts.append(line.strip())
+            yield b''.join(seq_parts), None
+        else:
+            for line in _chain_lines(first_line, f):
+                seq = line.strip()
+                if seq:
+                    yield seq, None
+
+
+def _chain_lines(first_line, f):
+    # Iterate over the lines of f, starting with the already read first_line
+    yield first_line
+    yield from f
+
+
+def _parse_chunk(seq_list, qual_list, width, trim, with_quality):
+    # Convert a list of raw reads (and qualities) into right padded arrays with one vectorized lookup
+    left, right = trim
+    if left or right:
+        seq_list = [seq[left:len(seq) - right] for seq in seq_list]
+    lengths = np.array([len(seq) for seq in seq_list], dtype=np.int64)
+    reads = _scatter_rows(BASE_TABLE[np.frombuffer(b''.join(seq_list), dtype=np.uint8)], lengths, width)
+    if not with_quality:
+        return reads, lengths
+
+    # Phred+33 qualities, trimmed like the sequences
+    if left or right:
+        qual_list = [qual[left:len(qual) - right] for qual in qual_list]
+    qual_list = [qual.ljust(len(seq), b'!')[:len(seq)] for seq, qual in zip(seq_list, qual_list)]
+    quals = np.frombuffer(b''.join(qual_list), dtype=np.uint8) - np.uint8(33)
+    return reads, lengths, _scatter_rows(quals, lengths, width)
+
+
+def _scatter_rows(values, lengths, width):
+    # Place the concatenated per-read values into a right padded (read x width) uint8 array
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.arange(len(values)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    keep = cols < width
+    array = np.zeros((len(lengths), width), dtype=np.uint8)
+    array[rows[keep], cols[keep]] = values[keep]
+    return array
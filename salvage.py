@@ -0,0 +1,338 @@
+import numpy as np
+from vt_enc import vt_decode_batch, vt_systematic_index
+from Palette_enc_dec import Palette_enc_segments, file_id_len, get_key, id_layout, quan_to_int_array, split_words
+
+ALIGN_INF = 1 << 14  # Distance of cells outside the band or the read
+
+
+def banded_align(reads, lengths, refs, band=3):
+    """
+    Banded edit distance between reads and reference oligos, with the alignment of every read onto its reference.
+
+    The dynamic programming runs over the reference positions, vectorized over all pairs and the 2 * band + 1
+    diagonals, so only indel paths that stay within band of the main diagonal are considered.
+
+    Parameters:
+    - reads: Right padded uint8 array of reads (one per row).
+    - lengths: Read lengths.
+    - refs: uint8 array of reference oligos (one per row, same length).
+    - band: Maximum net number of indels at any position.
+
+    Returns:
+    - Edit distances (ALIGN_INF when the read length is outside the band).
+    - Reads aligned onto their reference (uint8, reference length): inserted read symbols are dropped and
+      deleted ones are taken from the reference.
+    - Boolean mask of the aligned symbols taken from the reference (all of them outside the band).
+    """
+    refs = np.asarray(refs, dtype=np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    pair_num, ref_len = refs.shape
+    width = 2 * band + 1
+    padded = np.zeros((pair_num, ref_len + band + 1), dtype=np.uint8)
+    read_width = min(np.shape(reads)[1], padded.shape[1])
+    padded[:, :read_width] = np.asarray(reads)[:, :read_width]
+
+    # dist[:, d] holds the distance of the prefixes ref[:i] and read[:i + d - band]
+    offsets = np.arange(width) - band
+    dist = np.where((offsets >= 0)[None, :] & (offsets[None, :] <= lengths[:, None]), offsets[None, :], ALIGN_INF)
+    ops = np.zeros((ref_len + 1, pair_num, width), dtype=np.uint8)  # 0: match, 1: deletion, 2: insertion
+    for i in range(1, ref_len + 1):
+        j = i + offsets
+        valid = (j[None, :] >= 0) & (j[None, :] <= lengths[:, None])
+        symbols = padded[:, np.clip(j - 1, 0, padded.shape[1] - 1)]
+        diag = np.where(j[None, :] >= 1, dist + (symbols != refs[:, i - 1, None]), ALIGN_INF)
+        up = np.concatenate([dist[:, 1:], np.full((pair_num, 1), ALIGN_INF)], axis=1) + 1
+        cur = np.minimum(diag, up)
+        op = (up < diag).astype(np.uint8)
+        for d in range(1, width):
+            left = cur[:, d - 1] + 1
+            better = left < cur[:, d]
+            cur[:, d] = np.where(better, left, cur[:, d])
+            op[:, d] = np.where(better, 2, op[:, d])
+        dist = np.minimum(np.where(valid, cur, ALIGN_INF), ALIGN_INF)
+        ops[i] = op
+
+    end = lengths - ref_len + band
+    in_band = (end >= 0) & (end < width)
+    edit_dist = np.full(pair_num, ALIGN_INF, dtype=np.int64)
+    edit_dist[in_band] = dist[in_band, end[in_band]]
+
+    # Trace back all alignments together
+    aligned = refs.copy()
+    filled = np.ones(refs.shape, dtype=bool)
+    rows = np.flatnonzero(edit_dist < ALIGN_INF)
+    i = np.full(len(rows), ref_len)
+    j = lengths[rows].copy()
+    while len(rows):
+        op = ops[i, rows, j - i + band]
+        match = op == 0
+        aligned[rows[match], i[match] - 1] = padded[rows[match], j[match] - 1]
+        filled[rows[match], i[match] - 1] = False
+        i = i - (op != 2)
+        j = j - (op != 1)
+        active = i > 0
+        rows, i, j = rows[active], i[active], j[active]
+    return edit_dist, aligned, filled
+
+
+def salvage_records(reads, lengths, accumulator_dic, length_ary, enc_binary_len_dic, code_word_len, vt_k,
+                    toatl_file_num, key_str, band=3, max_dist=4, min_gap=2, neighbors=False, max_votes=1):
+    """
+    Second decoding pass for reads that failed VT decoding.
+
+    The file ID and address of every failed read are guessed from its symbols at the information positions
+    (after key removal, with shifts of -1, 0 and +1 for an early indel, and with neighbors the addresses one
+    symbol away from the unshifted guess). The read is aligned with banded_align onto the re-encoded consensus
+    of every guessed address already voted on; if the best edit distance is at most max_dist and at least
+    min_gap below that of any other guess (an ambiguous read would vote for a wrong address), the aligned
+    read, now free of indels, is VT decoded again. Only decoded words that carry the guessed ID and address
+    are kept, to be added to the vote. The symbols that the alignment took from the consensus (read deletions)
+    get weight 0, so the consensus does not vote for itself. Failed reads are noisier than the decoded ones,
+    so only addresses with at most max_votes votes take them; addresses without any are left to seed_records.
+
+    Parameters:
+    - reads: Right padded uint8 array of the failed reads.
+    - lengths: Read lengths.
+    - accumulator_dic: Dictionary of the vote accumulators of the first pass, by file ID.
+    - length_ary: Radix.
+    - enc_binary_len_dic: Dictionary containing the length of the original binary sequence for each file.
+    - code_word_len: Length of the code word.
+    - vt_k: VT information bits.
+    - toatl_file_num: Total number of files.
+    - key_str: Key string.
+    - band: Maximum net number of indels of a salvaged read.
+    - max_dist: Maximum edit distance between a salvaged read and the consensus oligo.
+    - min_gap: Minimum difference between the edit distances of the best and the second best guess of a read.
+    - neighbors: Also try the addresses one symbol substitution away from the guessed one.
+    - max_votes: Maximum number of votes of an address for its salvaged reads to be kept.
+
+    Returns:
+    - Array of file IDs and array of payload/address words (one per row, uint8) of the salvaged reads.
+    - Vote weights of the payload/address symbols (uint8, 0 for symbols taken from the consensus, else 1).
+    """
+    reads = np.asarray(reads, dtype=np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    key, ab_word_len, id_len, systematic_index = _word_layout(length_ary, code_word_len, vt_k, toatl_file_num,
+                                                              key_str)
+
+    # Guess ID and address of every read for each shift, and keep the guesses of addresses already voted on
+    pair_read, pair_id, pair_address = [], [], []
+    for shift in (0, -1, 1):
+        raw = reads[:, np.clip(systematic_index + shift, 0, reads.shape[1] - 1)]
+        id_nums, ab_words = split_words(raw, key, ab_word_len, id_len)
+        for id_num in np.unique(id_nums):
+            accumulator = accumulator_dic.get(int(id_num))
+            if accumulator is None:
+                continue
+            read_index = np.flatnonzero(id_nums == id_num)
+            addresses = _addresses(accumulator, ab_words[read_index])
+            if shift == 0 and neighbors:
+                # Also try the addresses one symbol substitution away from the guess
+                neighbor_list = _neighbor_addresses(addresses, accumulator.b_len // 2)
+                read_index = np.concatenate([read_index] + [read_index] * len(neighbor_list))
+                addresses = np.concatenate([addresses] + neighbor_list)
+            known = (addresses >= 0) & (addresses < accumulator.seg_num)
+            known[known] = accumulator.counts[addresses[known]] > 0
+            pair_read.append(read_index[known])
+            pair_id.append(np.full(int(known.sum()), int(id_num)))
+            pair_address.append(addresses[known])
+    if not pair_read or not sum(len(index) for index in pair_read):
+        return _no_records(ab_word_len)
+    # Shifts may guess the same address twice
+    pair_read, pair_id, pair_address = np.unique(np.stack([np.concatenate(pair_read), np.concatenate(pair_id),
+                                                           np.concatenate(pair_address)]), axis=1)
+
+    # Re-encode the consensus of every guessed address and align the reads onto it
+    refs = np.zeros((len(pair_read), code_word_len), dtype=np.uint8)
+    for id_num in np.unique(pair_id):
+        rows = np.flatnonzero(pair_id == id_num)
+        accumulator = accumulator_dic[int(id_num)]
+        refs[rows] = Palette_enc_segments(accumulator.consensus_rows(pair_address[rows]), pair_address[rows],
+                                          length_ary, int(id_num), toatl_file_num, key_str,
+                                          enc_binary_len_dic[int(id_num)])[0]
+    edit_dist, aligned, filled = banded_align(reads[pair_read], lengths[pair_read], refs, band)
+
+    # Best guess of every read within max_dist and clearly ahead of the second best one
+    order = np.lexsort((edit_dist, pair_read))
+    first = np.flatnonzero(np.concatenate([[True], pair_read[order][1:] != pair_read[order][:-1]]))
+    best = order[first]
+    gap = np.full(len(first), ALIGN_INF, dtype=np.int64)
+    has_second = np.append(first[1:], len(order)) > first + 1
+    gap[has_second] = edit_dist[order[first[has_second] + 1]] - edit_dist[best[has_second]]
+    best = best[(edit_dist[best] <= max_dist) & (gap >= min_gap)]
+    # Failed reads are noisier than the decoded ones, their votes only help addresses with few votes
+    weak = np.zeros(len(best), dtype=bool)
+    for id_num in np.unique(pair_id[best]):
+        rows = np.flatnonzero(pair_id[best] == id_num)
+        weak[rows] = accumulator_dic[int(id_num)].counts[pair_address[best][rows]] <= max_votes
+    best = best[weak]
+    if len(best) == 0:
+        return _no_records(ab_word_len)
+
+    # VT decode the aligned reads, now free of indels
+    dec_words, dec_fail = vt_decode_batch(aligned[best], code_word_len, vt_k,
+                                          np.full(len(best), code_word_len, dtype=np.int64))
+    best, dec_words = best[~dec_fail], dec_words[~dec_fail]
+    id_nums, ab_words = split_words(dec_words, key, ab_word_len, id_len)
+    ab_weights = ~filled[best][:, systematic_index[id_layout(ab_word_len, id_len)[1][:ab_word_len]]]
+    keep = _matches(dec_words, pair_address[best] * toatl_file_num + pair_id[best], accumulator_dic, key, ab_word_len,
+                    id_len, toatl_file_num)
+    return id_nums[keep], ab_words[keep], ab_weights[keep].astype(np.uint8)
+
+
+def seed_records(reads, lengths, accumulator_dic, length_ary, code_word_len, vt_k, toatl_file_num, key_str, band=3,
+                 max_dist=8, min_reads=2, chunk_size=20000):
+    """
+    Recover the addresses that no read voted for from the reads of theirs that failed VT decoding.
+
+    The failed reads are grouped by the file ID and address read off their information positions (after key
+    removal), keeping the expected addresses without votes. Every group of at least min_reads reads is
+    aligned with banded_align onto one of its reads (of the code word length if possible), the aligned reads
+    vote per position for a consensus, ignoring the symbols filled in by the alignment, and the group is
+    aligned and voted again onto that consensus. A consensus that VT decodes to the ID and address of its
+    group is kept, once for every read within max_dist of it if there are at least min_reads of them. In the
+    other groups, the reads within max_dist, aligned onto the consensus and so free of indels, are VT decoded
+    again and kept when they carry the ID and address of their group (the symbols filled in by the alignment
+    get weight 0).
+
+    Parameters:
+    - reads: Right padded uint8 array of the failed reads.
+    - lengths: Read lengths.
+    - accumulator_dic: Dictionary of the vote accumulators of the first pass, by file ID.
+    - length_ary: Radix.
+    - code_word_len: Length of the code word.
+    - vt_k: VT information bits.
+    - toatl_file_num: Total number of files.
+    - key_str: Key string.
+    - band: Maximum net number of indels of a read.
+    - max_dist: Maximum edit distance between a read and the consensus of its group.
+    - min_reads: Minimum number of reads of a group.
+    - chunk_size: Maximum number of reads aligned at a time.
+
+    Returns:
+    - Array of file IDs and array of payload/address words (one per row, uint8) of the seeded reads.
+    - Vote weights of the payload/address symbols (uint8, 0 for symbols taken from the consensus, else 1).
+    - Boolean mask of the reads behind the records.
+    """
+    reads = np.asarray(reads, dtype=np.uint8)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    key, ab_word_len, id_len, systematic_index = _word_layout(length_ary, code_word_len, vt_k, toatl_file_num,
+                                                              key_str)
+    seeded = np.zeros(len(lengths), dtype=bool)
+
+    # Signature (address * toatl_file_num + file ID) of the reads of expected addresses without votes
+    id_nums, ab_words = split_words(reads[:, np.minimum(systematic_index, reads.shape[1] - 1)], key, ab_word_len,
+                                    id_len)
+    signatures = np.full(len(lengths), -1, dtype=np.int64)
+    for id_num in np.unique(id_nums):
+        accumulator = accumulator_dic.get(int(id_num))
+        if accumulator is None:
+            continue
+        rows = np.flatnonzero(id_nums == id_num)
+        addresses = _addresses(accumulator, ab_words[rows])
+        empty = (addresses >= 0) & (addresses < accumulator.seg_num)
+        empty[empty] = (accumulator.counts[addresses[empty]] == 0) & accumulator.expected[addresses[empty]]
+        signatures[rows[empty]] = addresses[empty] * toatl_file_num + id_num
+
+    # Groups of at least min_reads reads, reads of the code word length first
+    members = np.flatnonzero(signatures >= 0)
+    members = members[np.lexsort((lengths[members] != code_word_len, signatures[members]))]
+    group_sigs, starts, sizes = np.unique(signatures[members], return_index=True, return_counts=True)
+    big = sizes >= min_reads
+    group_sigs, starts, sizes = group_sigs[big], starts[big], sizes[big]
+
+    record_ids, record_words, record_weights = [], [], []
+    group = 0
+    while group < len(group_sigs):
+        # Whole groups, up to chunk_size reads
+        group_end = group + max(int(np.searchsorted(np.cumsum(sizes[group:]), chunk_size, side='right')), 1)
+        batch_sigs, batch_sizes = group_sigs[group:group_end], sizes[group:group_end]
+        batch = np.concatenate([members[start:start + size] for start, size in zip(starts[group:group_end],
+                                                                                   batch_sizes)])
+        batch_group = np.repeat(np.arange(len(batch_sigs)), batch_sizes)
+        batch_starts = np.cumsum(batch_sizes) - batch_sizes
+        group = group_end
+
+        # The first reference is a read of the group, with its own errors
+        consensus = reads[batch[batch_starts], :code_word_len]
+        for _ in range(2):
+            edit_dist, aligned, filled = banded_align(reads[batch], lengths[batch], consensus[batch_group], band)
+            near = edit_dist <= max_dist
+            votes = np.add.reduceat((aligned[:, :, None] == np.arange(4, dtype=np.uint8)) &
+                                    (~filled & near[:, None])[:, :, None], batch_starts, axis=0, dtype=np.uint32)
+            # Ties and positions without votes keep the reference symbol
+            votes = 2 * votes + (consensus[:, :, None] == np.arange(4, dtype=np.uint8))
+            consensus = votes.argmax(axis=2).astype(np.uint8)
+        support = np.add.reduceat(near.astype(np.int64), batch_starts)
+
+        # Consensus reads that decode to the ID and address of their group vote once per supporting read
+        dec_words, dec_fail = vt_decode_batch(consensus, code_word_len, vt_k,
+                                              np.full(len(consensus), code_word_len, dtype=np.int64))
+        keep = ~dec_fail & (support >= min_reads)
+        keep[keep] = _matches(dec_words[keep], batch_sigs[keep], accumulator_dic, key, ab_word_len, id_len,
+                              toatl_file_num)
+        dec_ids, dec_ab_words = split_words(dec_words[keep], key, ab_word_len, id_len)
+        record_ids.append(np.repeat(dec_ids, support[keep]))
+        record_words.append(np.repeat(dec_ab_words, support[keep], axis=0))
+        record_weights.append(np.ones((int(support[keep].sum()), ab_word_len), dtype=np.uint8))
+        seeded[batch[keep[batch_group] & near]] = True
+
+        # The reads of the other groups, aligned onto the consensus and so free of indels, are VT decoded again
+        rows = np.flatnonzero(near & ~keep[batch_group])
+        dec_words, dec_fail = vt_decode_batch(aligned[rows], code_word_len, vt_k,
+                                              np.full(len(rows), code_word_len, dtype=np.int64))
+        rows, dec_words = rows[~dec_fail], dec_words[~dec_fail]
+        match = _matches(dec_words, batch_sigs[batch_group[rows]], accumulator_dic, key, ab_word_len, id_len,
+                         toatl_file_num)
+        rows = rows[match]
+        dec_ids, dec_ab_words = split_words(dec_words[match], key, ab_word_len, id_len)
+        record_ids.append(dec_ids)
+        record_words.append(dec_ab_words)
+        record_weights.append(~filled[rows][:, systematic_index[id_layout(ab_word_len, id_len)[1][:ab_word_len]]])
+        seeded[batch[rows]] = True
+
+    if not record_ids:
+        return _no_records(ab_word_len) + (seeded,)
+    return (np.concatenate(record_ids), np.concatenate(record_words), np.concatenate(record_weights).astype(np.uint8),
+            seeded)
+
+
+def _matches(dec_words, signatures, accumulator_dic, key, ab_word_len, id_len, toatl_file_num):
+    # Whether decoded words carry the file ID and address of their signatures (address * toatl_file_num + ID)
+    dec_ids, dec_ab_words = split_words(dec_words, key, ab_word_len, id_len)
+    match = dec_ids == signatures % toatl_file_num
+    for id_num in np.unique(dec_ids[match]):
+        rows = np.flatnonzero(match & (dec_ids == id_num))
+        match[rows] = _addresses(accumulator_dic[int(id_num)], dec_ab_words[rows]) == signatures[rows] // toatl_file_num
+    return match
+
+
+def _neighbor_addresses(addresses, quan_len):
+    # Addresses differing from the given ones in one of their quan_len quaternary symbols
+    neighbor_list = []
+    for position in range(quan_len):
+        weight = 4 ** position
+        digit = (addresses // weight) % 4
+        for delta in (1, 2, 3):
+            neighbor_list.append(addresses + ((digit + delta) % 4 - digit) * weight)
+    return neighbor_list
+
+
+def _addresses(accumulator, ab_words):
+    # Addresses carried by payload/address words of the file of accumulator
+    return quan_to_int_array(ab_words[:, accumulator.inverse][:, accumulator.a_len:])
+
+
+def _word_layout(length_ary, code_word_len, vt_k, toatl_file_num, key_str):
+    # Key, payload/address word length, ID length and information positions of the code words
+    id_len = file_id_len(toatl_file_num)
+    key = get_key(length_ary, key_str, vt_k)
+    key = np.frombuffer(key.encode(), dtype=np.uint8) - ord('0')
+    word_len = min(vt_k, len(key))
+    return key, word_len - id_len // 2, id_len, vt_systematic_index(code_word_len)[:word_len]
+
+
+def _no_records(ab_word_len):
+    # Empty file IDs, payload/address words and vote weights
+    return (np.zeros(0, dtype=np.int64), np.zeros((0, ab_word_len), dtype=np.uint8),
+            np.zeros((0, ab_word_len), dtype=np.uint8))
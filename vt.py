@@ -1,5 +1,11 @@
+import functools
 import numpy as np
 
+# number of distinct code parameter sets kept by get_code
+CODE_CACHE_SIZE = 32
+# number of rows widened to int64 at a time by VTCode.syndrome_batch
+SYNDROME_BLOCK = 4096
+
 class VTCode:
     def __init__(self, n: int, q: int, a = 0, b = 0,
                 correct_substitutions = False):
@@ -62,6 +68,72 @@ class VTCode:
         return self._decode_codeword(y)
 
 
+    def decode_batch(self, Y, lengths = None):
+        '''
+        input  Y: list of noisy codewords (1d lists or np arrays), or 2d np
+                  array with one noisy codeword per row, right padded and with
+                  the true lengths given in lengths
+        return X: decoded message bits as a 2d numpy array with dtype uint8
+                  (shape N x k), rows where decoding failed are all zero
+               fail: boolean 1d np array, True where decoding failed
+        '''
+        if lengths is None:
+            Y, lengths = pad_rows(Y, self.n + 1)
+        Y = np.asarray(Y)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        assert Y.ndim == 2 and lengths.size == Y.shape[0]
+        k = self.systematic_positions.size if self.q == 2 else self.k
+        X = np.zeros((Y.shape[0], k), dtype=np.uint8)
+        fail = np.ones(Y.shape[0], dtype=bool)
+        if Y.size and ((np.max(Y) > self.q-1) or (np.min(Y) < 0)):
+            print("Value in y out of range 0...q-1")
+            raise RuntimeError
+        if self.q != 2:
+            for i in range(Y.shape[0]):
+                x = self.decode(Y[i, :lengths[i]].astype(np.int64))
+                if x is not None:
+                    X[i] = x
+                    fail[i] = False
+            return X, fail
+
+        # reads without indel: classify by syndrome for all rows at once
+        rows = np.flatnonzero(lengths == self.n)
+        y = Y[rows, :self.n].astype(np.uint8)
+        syndrome = self.syndrome_batch(y)
+        if self.correct_substitutions:
+            # 1 flipped to 0 at s, or 0 flipped to 1 at 2n+1-s
+            sub = np.flatnonzero((syndrome > 0) & (syndrome < self.n+1))
+            y[sub, syndrome[sub]-1] = 1
+            sub = np.flatnonzero(syndrome >= self.n+1)
+            y[sub, 2*self.n - syndrome[sub]] = 0
+            syndrome = self.syndrome_batch(y)
+        ok = syndrome == 0
+        X[rows[ok]] = y[ok][:, self.systematic_index]
+        fail[rows[ok]] = False
+
+        # single insertion or deletion, fixed row by row
+        for i in np.flatnonzero(np.abs(lengths - self.n) == 1):
+            y = _correct_binary_indel(self.n, self.m, self.a, Y[i, :lengths[i]].astype(np.int64))
+            if self._is_codeword(y):
+                X[i] = self._decode_codeword_binary(y)
+                fail[i] = False
+        return X, fail
+
+
+    def syndrome_batch(self, Y, block = SYNDROME_BLOCK):
+        '''
+        input  Y: 2d np array of binary words of length n (one per row, any
+                  integer dtype)
+        return syndromes a - sum(i*y_i) mod m of all rows (int64), computed
+               block by block so only block rows are widened at a time
+        '''
+        syndrome = np.zeros(Y.shape[0], dtype=np.int64)
+        for start in range(0, Y.shape[0], block):
+            y = Y[start:start + block].astype(np.int64)
+            syndrome[start:start + block] = np.mod(self.a - y @ self.weights, self.m)
+        return syndrome
+
+
     def encode(self, x):
         '''
         input  x: list or 1d np array with the message bits (length k)
@@ -79,6 +151,23 @@ class VTCode:
             return self._encode_q_ary(x)
 
 
+    def encode_batch(self, X):
+        '''
+        input  X: 2d np array with one message per row (shape N x k)
+        return Y: encoded codewords as a 2d numpy array with dtype int64
+                  (shape N x n), row i is the codeword of X[i]
+        '''
+        X = np.asarray(X, dtype = np.int64)
+        assert X.ndim == 2
+        if X.size and ((np.max(X) > 1) or (np.min(X) < 0)):
+            print("Value in X out of range {0, 1}")
+            raise RuntimeError
+        if self.q == 2:
+            return self._encode_binary_batch(X)
+        else:
+            return np.array([self._encode_q_ary(x) for x in X], dtype = np.int64)
+
+
     def _decode_codeword(self, y):
         '''
         decode a codeword (if not a codeword, returns None)
@@ -95,7 +184,7 @@ class VTCode:
         decoding helper for binary case (assume it's a valid codeword)
         '''
         # just return values at the systematic positions
-        return y[self.systematic_positions-1]
+        return y[self.systematic_index]
 
 
 
@@ -105,7 +194,7 @@ class VTCode:
         '''
         y = np.zeros(self.n, dtype = np.int64)
         # first set systematic positions
-        y[self.systematic_positions-1] = x
+        y[self.systematic_index] = x
         # now set the rest positions based on syndrome
         syndrome = _compute_syndrome_binary(self.m, self.a, y)
         if syndrome != 0:
@@ -119,6 +208,24 @@ class VTCode:
         return y
 
 
+    def _encode_binary_batch(self, X):
+        '''
+        encoding helper for binary case, one codeword per row of X
+        '''
+        Y = np.zeros((X.shape[0], self.n), dtype = np.int64)
+        # first set systematic positions
+        Y[:, self.systematic_index] = X
+        # syndromes of all rows with one matrix product
+        syndrome = np.mod(self.a - Y @ self.weights, self.m)
+        # greedy parity assignment, same order as _encode_binary
+        for pos in reversed(self.parity_positions):
+            bit = (syndrome >= pos).astype(np.int64)
+            Y[:, pos-1] = bit
+            syndrome -= bit * pos
+        assert np.all(np.mod(self.a - Y @ self.weights, self.m) == 0)
+        return Y
+
+
     def _is_codeword(self, y):
         '''
         return True if y is a codeword
@@ -148,10 +255,34 @@ class VTCode:
             else:
                 self.parity_positions[t] = self.n
         self.systematic_positions =  np.setdiff1d(np.arange(1,self.n+1), self.parity_positions)
+        self.systematic_index = self.systematic_positions - 1
+        # position weights used in the syndrome sum(i*y_i)
+        self.weights = np.arange(1, self.n+1, dtype=np.int64)
+        # codes are shared through get_code, so keep the tables read-only
+        for table in (self.parity_positions, self.systematic_positions,
+                      self.systematic_index, self.weights):
+            table.setflags(write=False)
         return
 
 
 
+def get_code(n: int, q: int, a = 0, b = 0, correct_substitutions = False):
+    '''
+    Returns a shared VTCode for the given parameters.
+    Codes are kept in a process-wide LRU registry (CODE_CACHE_SIZE entries),
+    so the position tables are built once per parameter set. The returned
+    object must be treated as immutable.
+    '''
+    return _cached_code(int(n), int(q), int(a), int(b), bool(correct_substitutions))
+
+@functools.lru_cache(maxsize=CODE_CACHE_SIZE)
+def _cached_code(n, q, a, b, correct_substitutions):
+    return VTCode(n, q, a, b, correct_substitutions = correct_substitutions)
+
+
+
+
+@functools.lru_cache(maxsize=CODE_CACHE_SIZE)
 def find_smallest_n(k: int, q : int, correct_substitutions = False):
     '''
     Returns smallest n for a code with given k and q.
@@ -179,6 +310,23 @@ def find_smallest_n(k: int, q : int, correct_substitutions = False):
         n += 1
     return n
 
+def pad_rows(rows, width: int):
+    '''
+    Stack variable length sequences into a right zero-padded 2d np array.
+    Sequences longer than width are truncated (their true length is kept).
+    Returns the padded array (shape N x width) and the array of lengths.
+    '''
+    lengths = np.array([len(row) for row in rows], dtype=np.int64)
+    padded = np.zeros((len(rows), width), dtype=np.int64)
+    # fill all rows of one length together
+    for length in np.unique(lengths):
+        idx = np.flatnonzero(lengths == length)
+        cut = min(length, width)
+        if cut > 0:
+            padded[idx, :cut] = np.array([rows[i][:cut] for i in idx])
+    return padded, lengths
+
+@functools.lru_cache(maxsize=CODE_CACHE_SIZE)
 def find_k(n: int, q: int, correct_substitutions = False):
     '''
     Returns k for a code with given n and q.
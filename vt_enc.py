@@ -6,8 +6,9 @@ Created on Tue Sep 19 20:39:00 2023
 @author: serena-mo
 """
 
-from vt import VTCode,find_smallest_n
+from vt import find_smallest_n,get_code,pad_rows
 import numpy as np
+import metrics
 import ast
 import re
 
@@ -33,14 +34,26 @@ def vt_encode(msg):
     #print(msg_array)
     n = find_smallest_n(len(msg_array), 2,correct_substitutions = True)
     msg_0,msg_1 = deleaved_str(msg_array)
-    enc_msg_0 = VTCode(n, 2, 0, 0, correct_substitutions = True).encode(msg_0)
-    enc_msg_1 = VTCode(n, 2, 0, 0, correct_substitutions = True).encode(msg_1)
+    code = get_code(n, 2, 0, 0, correct_substitutions = True)
+    enc_msg_0 = code.encode(msg_0)
+    enc_msg_1 = code.encode(msg_1)
     enc_msg = leaved_str(enc_msg_0, enc_msg_1)
     enc_msg = np.array(enc_msg,dtype=np.int64)
     return enc_msg, n, len(msg_array)
 
+def vt_encode_batch(msg_array):
+    # Encode a 2-D array of quaternary messages (one message per row) at once
+    msg_array = np.asarray(msg_array, dtype=np.int64)
+    k = msg_array.shape[1]
+    n = find_smallest_n(k, 2, correct_substitutions = True)
+    code = get_code(n, 2, 0, 0, correct_substitutions = True)
+    enc_0 = code.encode_batch(msg_array % 2)
+    enc_1 = code.encode_batch(msg_array // 2)
+    enc_msg = enc_0 + enc_1 * 2
+    return enc_msg, n, k
+
 def vt_decode(channel_output, n, k):
-    code = VTCode(n, 2, 0, 0, correct_substitutions = True)
+    code = get_code(n, 2, 0, 0, correct_substitutions = True)
     enc_0,enc_1 = deleaved_str(channel_output)
     
     dec_0 = code.decode(enc_0)    
@@ -56,6 +69,41 @@ def vt_decode(channel_output, n, k):
         #print(type(dec_str))
         return dec_str
 
+def vt_decode_batch(channel_outputs, n, k, lengths=None):
+    # Decode a list of reads at once (or a right padded 2-D array of reads
+    # with their lengths), returns the decoded quaternary words (one per row)
+    # and a boolean mask of the reads that failed
+    code = get_code(n, 2, 0, 0, correct_substitutions = True)
+    if lengths is None:
+        reads, lengths = pad_rows(channel_outputs, n + 1)
+    else:
+        reads = channel_outputs
+    # Bit planes stay uint8, the VT syndromes are computed blockwise
+    reads = np.asarray(reads, dtype=np.uint8)
+    with metrics.timer('vt_decode'):
+        dec_0, fail_0 = code.decode_batch(reads & 1, lengths)
+        dec_1, fail_1 = code.decode_batch(reads >> 1, lengths)
+    dec_words = dec_0 + dec_1 * 2
+    if metrics.enabled():
+        count_corrections(code, reads, lengths, fail_0 | fail_1)
+    return dec_words, fail_0 | fail_1
+
+def count_corrections(code, reads, lengths, fail):
+    # Count the reads decoded without error, with a substitution, an insertion or a deletion, and the failed ones
+    lengths = np.asarray(lengths)
+    full = np.flatnonzero((lengths == code.n) & ~fail)
+    y = np.asarray(reads, dtype=np.uint8)[full, :code.n]
+    dirty = (code.syndrome_batch(y & 1) != 0) | (code.syndrome_batch(y >> 1) != 0)
+    metrics.inc('vt_corrections', len(full) - int(dirty.sum()), {'type': 'none'})
+    metrics.inc('vt_corrections', int(dirty.sum()), {'type': 'substitution'})
+    metrics.inc('vt_corrections', int(np.sum((lengths == code.n + 1) & ~fail)), {'type': 'insertion'})
+    metrics.inc('vt_corrections', int(np.sum((lengths == code.n - 1) & ~fail)), {'type': 'deletion'})
+    metrics.inc('vt_corrections', int(np.sum(fail)), {'type': 'fail'})
+
+def vt_systematic_index(n):
+    # Codeword positions (0-indexed) carrying the decoded information symbols
+    return get_code(n, 2, 0, 0, correct_substitutions = True).systematic_index
+
 if __name__ == '__main__':
     msg = '20032101212111111031111203230320023303003011023303030300022202130000011'
     enc, n, k = vt_encode(msg)